@@ -1 +1,3 @@
-import src.GUI
\ No newline at end of file
+# the gui only starts when this file is run, not when a worker process started with spawn imports it again
+if __name__ == "__main__":
+    import src.GUI
@@ -0,0 +1,29 @@
+import ffmpeg
+import numpy as np
+
+from src.exceptions import EncodingError
+from src.globals import Globals
+
+
+# encodes audio into a file with a single ffmpeg process. samples are piped to ffmpeg as they are produced, so the
+# encoder runs while the rest of the track is still being made and the whole track never has to be in memory
+class AudioSink:
+    # samples passed to write are 16 bit integers; for more than one channel, arrays of shape (samples, channels).
+    # codec and bitrate default to the values in Globals
+    def __init__(self, path, sample_rate, channels=1, codec=None, bitrate=None):
+        audio = ffmpeg.input('pipe:', format='s16le', ar=sample_rate, ac=channels)
+        output = ffmpeg.output(audio, path, acodec=codec or Globals.audio_codec,
+                               audio_bitrate=bitrate or Globals.audio_bitrate)
+        # keep ffmpeg quiet; its progress output is not read and would eventually fill the pipe
+        self.process = output.overwrite_output()\
+            .run_async(cmd=['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostats'], pipe_stdin=True)
+
+    # write the next samples
+    def write(self, samples):
+        self.process.stdin.write(np.ascontiguousarray(samples, dtype='<i2').data)
+
+    # finish encoding and wait for ffmpeg to exit
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise EncodingError("ffmpeg exited with code " + str(self.process.returncode))
@@ -1,11 +1,145 @@
+import io
+import subprocess
 import threading
 import time
+import wave
 from tkinter import ttk
+import numpy as np
 from PIL import ImageTk
 from PIL import Image
 from src.exceptions import FileLockedError
 
 
+# shows a text file a few rows at a time. rows are read from the file when they are scrolled into view, and the file
+# is only read up to the furthest row shown so far, so opening a huge file takes as long as opening a small one
+class TextFileView:
+    rows = 40  # rows visible at a time
+
+    def __init__(self, master, path):
+        self.file = open(path, 'rb')
+        self.file.seek(0, 2)
+        self.size = self.file.tell()
+        self.offsets = [0]  # byte offset of the start of each row found so far
+        self.complete = False  # whether offsets holds every row of the file
+        self.top = 0  # first visible row
+
+        self.label = ttk.Label(master=master, anchor="nw", justify="left")
+        self.label.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ttk.Scrollbar(master=master, orient="vertical", command=self.on_scroll)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        # windows and macos send mouse wheel events, x11 sends button 4 and 5 presses
+        self.label.bind("<MouseWheel>", lambda event: self.scroll_to(self.top + (-3 if event.delta > 0 else 3)))
+        self.label.bind("<Button-4>", lambda event: self.scroll_to(self.top - 3))
+        self.label.bind("<Button-5>", lambda event: self.scroll_to(self.top + 3))
+
+        self.scroll_to(0)
+
+    # find the start of rows until row is found or the file ends
+    def index_until(self, row):
+        if self.complete or row < len(self.offsets) - 1:
+            return
+        self.file.seek(self.offsets[-1])
+        while len(self.offsets) - 1 <= row:
+            line = self.file.readline()
+            if not line:
+                self.complete = True
+                break
+            self.offsets.append(self.offsets[-1] + len(line))
+
+    # number of rows in the file; estimated from the rows read so far until the whole file was read
+    def row_count(self):
+        known = len(self.offsets) - 1
+        if self.complete or known == 0:
+            return known
+        return max(known, int(self.size * known / self.offsets[-1]))
+
+    def scroll_to(self, row):
+        self.index_until(row + self.rows)
+        self.top = max(min(row, len(self.offsets) - 1 - self.rows), 0)
+        bottom = min(self.top + self.rows, len(self.offsets) - 1)
+
+        self.file.seek(self.offsets[self.top])
+        text = self.file.read(self.offsets[bottom] - self.offsets[self.top]).decode('utf-8').replace("\r", "")
+        self.label.configure(text=text)
+
+        total = max(self.row_count(), 1)
+        self.scrollbar.set(self.top / total, bottom / total)
+
+    # called by the scrollbar: ("moveto", fraction) or ("scroll", amount, "units" or "pages")
+    def on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * self.row_count()))
+        elif unit == "pages":
+            self.scroll_to(self.top + int(amount) * self.rows)
+        else:
+            self.scroll_to(self.top + int(amount))
+
+    def destroy(self):
+        self.label.destroy()
+        self.scrollbar.destroy()
+        self.file.close()
+
+
+# shows a short piece of mono 16 bit audio as a waveform, with a button that plays it. it is played by ffplay, which
+# comes with ffmpeg
+class AudioView:
+    width, height = (450, 120)
+
+    def __init__(self, master, samples, sample_rate):
+        # keep the audio as a wav file in memory, it is piped to ffplay
+        wav = io.BytesIO()
+        with wave.open(wav, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes(np.ascontiguousarray(samples, dtype='<i2').tobytes())
+        self.wav = wav.getvalue()
+        self.player = None
+
+        image = ImageTk.PhotoImage(image=self.waveform(samples))
+        self.label = ttk.Label(master=master, image=image)
+        self.label.pointer = image  # prevent the image from getting garbage collected
+        self.label.grid(row=0, column=0, sticky="nw")
+        self.button = ttk.Button(master=master, text="play", command=self.play)
+        self.button.grid(row=1, column=0, sticky="nw")
+
+    # one column per group of samples, drawn from the lowest to the highest sample in the group
+    @staticmethod
+    def waveform(samples):
+        per_column = max(len(samples) // AudioView.width, 1)
+        columns = np.zeros(AudioView.width * per_column, dtype=np.int32)
+        columns[:min(len(samples), len(columns))] = samples[:len(columns)]
+        columns = columns.reshape(AudioView.width, per_column)
+
+        # sample values to rows, the highest value at the top
+        def to_row(value):
+            return (32767 - value) * (AudioView.height - 1) // 65535
+
+        rows = np.arange(AudioView.height)[:, None]
+        drawn = (rows >= to_row(columns.max(axis=1))) & (rows <= to_row(columns.min(axis=1)))
+        return Image.fromarray(np.where(drawn, 0, 255).astype(np.uint8), "L")
+
+    def play(self):
+        self.stop()
+        try:
+            self.player = subprocess.Popen(['ffplay', '-nodisp', '-autoexit', '-loglevel', 'error', '-i', 'pipe:'],
+                                           stdin=subprocess.PIPE)
+        except FileNotFoundError:
+            self.button.configure(text="can't play, ffplay not found", state="disabled")
+            return
+        # writing blocks until ffplay has read most of it, so don't do it on the gui thread
+        threading.Thread(target=self.player.communicate, args=(self.wav,), daemon=True).start()
+
+    def stop(self):
+        if self.player is not None and self.player.poll() is None:
+            self.player.kill()
+
+    def destroy(self):
+        self.stop()
+        self.label.destroy()
+        self.button.destroy()
+
+
 # preview window common parts
 class PreviewWindow:
 
@@ -46,6 +180,8 @@ class PreviewWindow:
         # default label for placing text or an image
         self.main = ttk.Label(master=self.container, text="loading...")
         self.main.grid(row=0, column=0)
+        self.text_view = None  # TextFileView replacing the main label, if a text file is shown
+        self.audio_view = None  # AudioView replacing the main label, if audio is shown
 
     # change text in status label (next to progress bar)
     def progress_update(self, text):
@@ -73,7 +209,27 @@ class PreviewWindow:
         # allow garbage collection of previous image
         self.main.pointer = None
 
+    # show a text file that may be too big to put in a label, only reading the rows that are scrolled into view
+    def put_text_file(self, path):
+        if self.text_view is not None:
+            self.text_view.destroy()
+        self.main.grid_remove()
+        self.main.pointer = None
+        self.text_view = TextFileView(self.container, path)
+
+    # show mono 16 bit samples that can be played
+    def put_audio(self, samples, sample_rate):
+        if self.audio_view is not None:
+            self.audio_view.destroy()
+        self.main.grid_remove()
+        self.main.pointer = None
+        self.audio_view = AudioView(self.container, samples, sample_rate)
+
     def destroy(self):
+        if self.text_view is not None:
+            self.text_view.destroy()
+        if self.audio_view is not None:
+            self.audio_view.destroy()
         self.window.destroy()
 
 
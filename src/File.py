@@ -14,6 +14,7 @@ class File:
         GIF = "gif"
         MP4 = "mp4"
         MP3 = "mp3"
+        MID = "mid"
         TXT = "txt"
 
     @staticmethod
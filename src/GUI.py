@@ -78,11 +78,18 @@ def config_image_to_mp3():
     ttk.Label(master=options_panel, text="path to destination directory: ").grid(row=2, column=0, sticky="nw")
     mp3_path_entry = ttk.Entry(master=options_panel, exportselection=0)
     mp3_path_entry.grid(row=3, column=0, sticky="nw")
-    ttk.Button(master=options_panel, command=lambda: on_click_submit(), text="convert").grid(row=4, column=0, sticky="nw")
+    long_form = IntVar()
+    ttk.Checkbutton(master=options_panel, text="every pixel (long track)",
+                    variable=long_form).grid(row=4, column=0, sticky="nw")
+    score = IntVar()
+    ttk.Checkbutton(master=options_panel, text="score only (midi)", variable=score).grid(row=5, column=0, sticky="nw")
+    ttk.Button(master=options_panel, command=lambda: on_click_submit(),
+               text="convert").grid(row=6, column=0, sticky="nw")
 
     # button's on_click function
     def on_click_submit():
-        ImageToMP3(image_path_entry.get(), mp3_path_entry.get())
+        ImageToMP3(image_path_entry.get(), mp3_path_entry.get(), long_form=(long_form.get() == 1),
+                   score=(score.get() == 1))
 
 
 # config options panel for asciifier
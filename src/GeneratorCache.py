@@ -0,0 +1,97 @@
+import pickle
+from os import makedirs, replace
+from os.path import basename, exists, getmtime, splitext
+import numpy as np
+import dnnlib.tflib as tflib
+
+from src.globals import Globals
+
+
+# the generators of a gan model pickle, saved so they load faster. the structure of the networks is pickled without
+# their weights, and the weights go in one .npy file that is memory-mapped when loading and copied straight into
+# tensorflow. the discriminator, which is only needed for training, is left out.
+# saving and loading must happen with the graph and session of the networks as the defaults
+class GeneratorCache:
+    VERSION = 1
+    folder = Globals.working_folder_path + "/gan"
+
+    # (structure, weights) paths of the cache of a model pickle
+    @staticmethod
+    def paths(model_path):
+        name = GeneratorCache.folder + "/" + splitext(basename(model_path))[0] + "_generators"
+        return name + ".pkl", name + ".npy"
+
+    # whether there is a cache of the model pickle that was made after it
+    @staticmethod
+    def exists(model_path):
+        structure_path, weights_path = GeneratorCache.paths(model_path)
+        return exists(structure_path) and exists(weights_path) and getmtime(structure_path) >= getmtime(model_path)
+
+    @staticmethod
+    def save(model_path, G, Gs):
+        weights = []
+        size = [0]
+
+        # the pickled state of a network and its components, with every float32 variable replaced by the offset and
+        # shape of its values in weights
+        def strip(network):
+            state = network.__getstate__()
+            state["components"] = {name: strip(component) for name, component in state["components"].items()}
+            variables = []
+            for name, value in state["variables"]:
+                value = np.asarray(value)
+                if value.dtype == np.float32:
+                    variables.append((name, size[0], value.shape, None))
+                    weights.append(value.ravel())
+                    size[0] += value.size
+                else:
+                    variables.append((name, None, None, value))
+            state["variables"] = variables
+            return state
+
+        structure = (GeneratorCache.VERSION, strip(G), strip(Gs))
+        structure_path, weights_path = GeneratorCache.paths(model_path)
+        makedirs(GeneratorCache.folder, exist_ok=True)
+        # the structure is written last, so a cache is only used once both files are complete
+        with open(weights_path + ".tmp", 'wb') as f:
+            np.save(f, np.concatenate(weights) if weights else np.empty(0, dtype=np.float32))
+        replace(weights_path + ".tmp", weights_path)
+        with open(structure_path + ".tmp", 'wb') as f:
+            pickle.dump(structure, f, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(structure_path + ".tmp", structure_path)
+
+    # returns (G, Gs)
+    @staticmethod
+    def load(model_path):
+        structure_path, weights_path = GeneratorCache.paths(model_path)
+        with open(structure_path, 'rb') as f:
+            version, G_state, Gs_state = pickle.load(f)
+        if version != GeneratorCache.VERSION:
+            raise ValueError("generator cache " + structure_path + " is from another version")
+        weights = np.load(weights_path, mmap_mode='r')
+
+        # build a network from a state made by strip, components first like unpickling does
+        def restore(state):
+            state = dict(state)
+            state["components"] = {name: restore(component) for name, component in state["components"].items()}
+            state["variables"] = [(name, value if offset is None
+                                   else weights[offset:offset + int(np.prod(shape))].reshape(shape))
+                                  for name, offset, shape, value in state["variables"]]
+            network = tflib.Network.__new__(tflib.Network)
+            network.__setstate__(state)
+            return network
+
+        return restore(G_state), restore(Gs_state)
+
+
+if __name__ == "__main__":
+    # python -m src.GeneratorCache [path/to/model.pkl ...]
+    # caches the generators of the given models, or of every model in res/gan/models, ahead of the first job
+    import sys
+    from glob import glob
+    from src.ModelPool import ModelPool
+
+    for path in sys.argv[1:] or glob("res/gan/models/*.pkl"):
+        if not GeneratorCache.exists(path):
+            print("caching " + path)
+            ModelPool.get(path).release()  # loading a model that has no cache yet saves one
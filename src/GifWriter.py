@@ -0,0 +1,81 @@
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+
+# writes an animated gif one frame at a time instead of keeping every frame in memory until the end.
+# a frame identical to the one before it is not written again; the earlier frame is shown for longer instead.
+# a frame that only differs from the one before it in part of the image only stores that part
+class GifWriter:
+    # if palette is given, frames have one channel holding indices into it and are written as they are;
+    # otherwise frames are rgb(a) and every frame gets its own palette
+    def __init__(self, path, loop=0, palette=None):
+        self.file = open(path, 'wb')
+        self.loop = loop  # 0 loops forever
+        self.palette = palette
+
+        # the frame waiting to be written, and the last frame that was written; two buffers that swap places.
+        # _pending_duration is None when no frame is waiting
+        self._pending = None
+        self._pending_duration = None
+        self._previous = None
+        self.frames_written = 0
+
+    # add a frame (array of shape (height, width, channels)) shown for duration milliseconds
+    def write(self, frame, duration):
+        if self._pending_duration is not None and np.array_equal(frame, self._pending):
+            self._pending_duration += duration
+            return
+
+        self.flush()
+        if self._pending is None:
+            self._pending = np.empty_like(frame)
+        np.copyto(self._pending, frame)
+        self._pending_duration = duration
+
+    # write the pending frame to the file
+    def flush(self):
+        if self._pending_duration is None:
+            return
+
+        frame = self._pending
+        top, left = (0, 0)
+        if self._previous is not None:
+            # only store the rectangle that changed since the last frame; the rest stays on screen
+            changed = np.any(frame != self._previous, axis=2)
+            rows = np.flatnonzero(changed.any(axis=1))
+            columns = np.flatnonzero(changed.any(axis=0))
+            top, left = (rows[0], columns[0])
+            frame = frame[top:rows[-1] + 1, left:columns[-1] + 1]
+
+        image = self.to_palette(frame)
+        if self.frames_written == 0:
+            header, _ = GifImagePlugin.getheader(image, info={"loop": self.loop, "duration": self._pending_duration})
+            for chunk in header:
+                self.file.write(chunk)
+
+        # disposal 1 leaves the frame on screen, so the next one can be drawn over part of it
+        for chunk in GifImagePlugin.getdata(image, offset=(int(left), int(top)), duration=self._pending_duration,
+                                            disposal=1, include_color_table=True):
+            self.file.write(chunk)
+        self.frames_written += 1
+
+        # the frame just written becomes the one to compare against
+        self._previous, self._pending = (self._pending, self._previous)
+        self._pending_duration = None
+
+    # gifs can only hold 256 colors per frame
+    def to_palette(self, frame):
+        if self.palette is not None:
+            image = Image.fromarray(np.ascontiguousarray(frame[:, :, 0]), "L").convert("P")
+            image.putpalette(self.palette)
+            return image
+
+        if frame.shape[2] == 4:
+            frame = frame[:, :, :3]
+        return Image.fromarray(np.ascontiguousarray(frame)).convert("P", palette=Image.ADAPTIVE)
+
+    # write the last frame and end the file
+    def close(self):
+        self.flush()
+        self.file.write(b";")  # trailer
+        self.file.close()
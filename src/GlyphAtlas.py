@@ -0,0 +1,132 @@
+import numpy as np
+from PIL import Image
+
+
+# all character images of a script packed into one array, so a whole frame can be built with numpy indexing
+# instead of pasting every character with pillow
+class GlyphAtlas:
+    RGBA = "RGBA"
+    BGR = "BGR"  # channel order opencv reads and ffmpeg's bgr24 expects
+    L = "L"  # one gray channel; the characters are black and white, so this is the same image in a quarter the size
+    P = "P"  # one channel holding 0 for black and 1 for white; smallest, but loses the characters' smooth edges
+
+    PALETTES = {
+        L: [v for v in range(256) for _ in range(3)],  # palette index i is gray i
+        P: [0, 0, 0, 255, 255, 255]
+    }
+
+    # table is the WeightTable the characters come from, and glyphs is an RGBA array of shape (N, H, W, 4) with
+    # one image per character in table.characters, in the same order, already drawn on the background
+    def __init__(self, table, glyphs, mode=RGBA):
+        self.table = table
+        self.H, self.W = glyphs.shape[1:3]
+        self.mode = mode
+
+        if mode == GlyphAtlas.RGBA:
+            self.glyphs = glyphs
+        elif mode == GlyphAtlas.BGR:
+            self.glyphs = np.ascontiguousarray(glyphs[:, :, :, 2::-1])
+        else:
+            # the characters are gray, so any color channel is the gray value
+            self.glyphs = np.ascontiguousarray(glyphs[:, :, :, :1])
+            if mode == GlyphAtlas.P:
+                self.glyphs = (self.glyphs >= 128).astype(np.uint8)
+        self.channels = self.glyphs.shape[3]
+
+        # buffers are reused between frames of the same size
+        self._gathered = None
+        self._result = None
+
+    # the palette a single channel frame's values index into; None for rgb frames
+    def palette(self):
+        return GlyphAtlas.PALETTES.get(self.mode)
+
+    # turn a rendered frame into a pillow image, e.g. for the preview
+    def to_image(self, frame):
+        if self.mode == GlyphAtlas.RGBA:
+            return Image.fromarray(frame)
+        elif self.mode == GlyphAtlas.BGR:
+            return Image.fromarray(np.ascontiguousarray(frame[:, :, ::-1]))
+
+        image = Image.fromarray(np.ascontiguousarray(frame[:, :, 0]), "L")
+        if self.mode == GlyphAtlas.P:
+            image = image.convert("P")  # values are kept, only the palette changes
+            image.putpalette(self.palette())
+        return image
+
+    # map a grid of weights (height x width, uint8) to a grid of glyph indices
+    def glyph_indices(self, weights, rng):
+        return self.table.character_indices(weights, rng)
+
+    # like glyph_indices, but a cell keeps its glyph in every frame rendered with the same seed as long as its weight
+    # stays the same (see WeightTable.stable_character_indices)
+    def stable_glyph_indices(self, weights, seed):
+        return self.table.stable_character_indices(weights, seed)
+
+    # assemble the glyphs into one image; returns an array of shape (h * H, w * W, channels).
+    # if out is given the image is written into it, otherwise into an array that is reused by the next call with the
+    # same grid size, so copy it if it must be kept
+    def render(self, indices, out=None):
+        h, w = indices.shape
+        if self._gathered is None or self._gathered.shape[:2] != (h, w):
+            self._gathered = np.empty((h, w, self.H, self.W, self.channels), dtype=np.uint8)
+            self._result = np.empty((h * self.H, w * self.W, self.channels), dtype=np.uint8)
+        if out is None:
+            out = self._result
+
+        np.take(self.glyphs, indices, axis=0, out=self._gathered)
+        # (h, w, H, W) -> (h, H, w, W) lays the glyph rows out next to each other
+        cells = out.reshape(h, self.H, w, self.W, self.channels)
+        np.copyto(cells, self._gathered.transpose(0, 2, 1, 3, 4))
+        return out
+
+
+# renders the frames of a video one after another, only redrawing the characters whose weight changed since the
+# frame before. a character is kept until its pixel's weight moves more than threshold away from the weight it was
+# drawn for, so small changes like sensor noise don't make characters flicker
+class IncrementalRenderer:
+    def __init__(self, atlas, threshold=0):
+        self.atlas = atlas
+        self.threshold = threshold
+
+        self.weights = None  # weight each character was drawn for
+        self.indices = None  # glyph index of each character
+        self.canvas = None  # the last rendered frame
+        self.cells_drawn = 0
+        self.cells_rendered = 0
+
+    # render the next frame given its grid of weights. the result is written into out if given; otherwise the
+    # returned array is the renderer's own canvas, which changes with the next frame
+    def render(self, weights, rng, out=None):
+        weights = weights.astype(np.int16)
+        if self.weights is None or self.weights.shape != weights.shape:
+            # first frame, draw everything
+            self.weights = weights
+            self.indices = self.atlas.glyph_indices(weights, rng)
+            h, w = weights.shape
+            self.canvas = np.empty((h * self.atlas.H, w * self.atlas.W, self.atlas.channels), dtype=np.uint8)
+            self.atlas.render(self.indices, out=self.canvas)
+            self.cells_drawn += weights.size
+        else:
+            rows, columns = np.nonzero(np.abs(weights - self.weights) > self.threshold)
+            if len(rows) > 0:
+                changed = weights[rows, columns]
+                indices = self.atlas.glyph_indices(changed, rng)
+                self.weights[rows, columns] = changed
+                self.indices[rows, columns] = indices
+
+                h, w = weights.shape
+                cells = self.canvas.reshape(h, self.atlas.H, w, self.atlas.W, self.atlas.channels)
+                cells[rows, :, columns] = self.atlas.glyphs[indices]
+                self.cells_drawn += len(rows)
+
+        self.cells_rendered += weights.size
+
+        if out is None:
+            return self.canvas
+        np.copyto(out, self.canvas)
+        return out
+
+    # fraction of the characters rendered so far that actually had to be drawn
+    def redrawn(self):
+        return self.cells_drawn / self.cells_rendered if self.cells_rendered > 0 else 0.0
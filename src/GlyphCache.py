@@ -0,0 +1,130 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from os import listdir, makedirs, remove, replace, stat, utime
+from os.path import exists, getmtime, join
+import numpy as np
+
+from src.globals import Globals
+
+
+# rendered character images, kept in memory (shared by all script threads) and on disk in the working folder, so a
+# job only has to rasterize the font if no earlier job used the same font, size, cell size, colors, and image mode
+class GlyphCache:
+    folder = Globals.working_folder_path + "/glyphs"
+    memory_capacity = 8  # number of glyph sets kept in memory
+    disk_capacity = 256 * 1024 * 1024  # bytes of glyph sets kept on disk
+
+    _memory = OrderedDict()  # key: glyph array, least recently used first
+    _pending = {}  # key: event set when the thread rendering that key is done
+    _font_hashes = {}  # (font path, modification time): hash of the font file
+    _lock = threading.Lock()
+
+    # get the glyphs of characters as an array of shape (len(characters), H, W, channels).
+    # render(characters) is only called if the glyphs are not cached, and must return such an array
+    @staticmethod
+    def get(font_path, font_size, size, white_on_black, mode, characters, render):
+        key = GlyphCache.key(font_path, font_size, size, white_on_black, mode, characters)
+
+        while True:
+            with GlyphCache._lock:
+                glyphs = GlyphCache._memory.get(key)
+                if glyphs is not None:
+                    GlyphCache._memory.move_to_end(key)
+                    return glyphs
+
+                pending = GlyphCache._pending.get(key)
+                if pending is None:
+                    # nobody is loading these glyphs; this thread will
+                    pending = threading.Event()
+                    GlyphCache._pending.update({key: pending})
+                    break
+
+            # another thread is already rendering the same glyphs, wait for it instead of rendering them twice
+            pending.wait()
+
+        try:
+            glyphs = GlyphCache.read(key)
+            if glyphs is None:
+                glyphs = render(characters)
+                GlyphCache.write(key, glyphs)
+            GlyphCache.remember(key, glyphs)
+        finally:
+            with GlyphCache._lock:
+                GlyphCache._pending.pop(key).set()
+
+        return glyphs
+
+    # a name that changes whenever anything that affects how the glyphs look changes
+    @staticmethod
+    def key(font_path, font_size, size, white_on_black, mode, characters):
+        digest = hashlib.sha1()
+        digest.update(GlyphCache.font_hash(font_path).encode())
+        digest.update(repr((font_size, tuple(size), bool(white_on_black), mode)).encode())
+        digest.update(np.ascontiguousarray(characters, dtype=np.int32).tobytes())
+        return digest.hexdigest()
+
+    # hash of the contents of a font file; only recomputed when the file changes
+    @staticmethod
+    def font_hash(font_path):
+        font_id = (font_path, getmtime(font_path))
+        with GlyphCache._lock:
+            font_hash = GlyphCache._font_hashes.get(font_id)
+        if font_hash is None:
+            with open(font_path, 'rb') as f:
+                font_hash = hashlib.sha1(f.read()).hexdigest()
+            with GlyphCache._lock:
+                GlyphCache._font_hashes.update({font_id: font_hash})
+        return font_hash
+
+    # keep glyphs in memory, forgetting the least recently used set if there are too many
+    @staticmethod
+    def remember(key, glyphs):
+        glyphs.setflags(write=False)  # shared between threads, nobody may change them
+        with GlyphCache._lock:
+            GlyphCache._memory.update({key: glyphs})
+            GlyphCache._memory.move_to_end(key)
+            while len(GlyphCache._memory) > GlyphCache.memory_capacity:
+                GlyphCache._memory.popitem(last=False)
+
+    # load glyphs from disk, or return None if they were never saved (or were evicted)
+    @staticmethod
+    def read(key):
+        path = join(GlyphCache.folder, key + ".npy")
+        if not exists(path):
+            return None
+        try:
+            glyphs = np.load(path)
+            utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None  # corrupted or just evicted, render again
+        return glyphs
+
+    # save glyphs to disk, then delete the least recently used files until the folder fits in disk_capacity
+    @staticmethod
+    def write(key, glyphs):
+        makedirs(GlyphCache.folder, exist_ok=True)
+        path = join(GlyphCache.folder, key + ".npy")
+        with open(path + ".tmp", 'wb') as f:
+            np.save(f, glyphs)
+        replace(path + ".tmp", path)
+
+        # another thread may be removing files at the same time, so every file is looked at only once
+        files = []
+        for name in listdir(GlyphCache.folder):
+            if name.endswith(".npy"):
+                try:
+                    info = stat(join(GlyphCache.folder, name))
+                except OSError:
+                    continue  # already removed by another thread
+                files.append((info.st_mtime, info.st_size, join(GlyphCache.folder, name)))
+        files.sort(reverse=True)  # most recently used first
+        total = 0
+        for _, file_size, file in files:
+            if file != path and total + file_size > GlyphCache.disk_capacity:
+                try:
+                    remove(file)
+                except OSError:
+                    pass  # already removed by another thread
+            else:
+                total += file_size
@@ -0,0 +1,68 @@
+import numpy as np
+
+# transitions; the same values as GANVideo.TransitionTypes
+RANDOM = 0
+SEQUENCES = 1
+CONSTANT = 2
+
+
+# the path the latent input of a gan video takes, one latent per frame. latents are made a segment (10 seconds of
+# video) at a time with whole-array operations, and only the segment being used is kept, so a video of any length
+# takes the same memory
+class LatentTrajectory:
+    # start is the first latent, shape (1, components). random is the RandomState used to pick directions.
+    # with slerp, sequences move along the sphere between two latents instead of in a straight line, which keeps
+    # their length about the same as the length of normally distributed latents
+    def __init__(self, start, transition, speed, fps, random, slerp=False):
+        if transition not in (RANDOM, SEQUENCES, CONSTANT):
+            raise ValueError("unsupported transition " + str(transition))
+        self.transition = transition
+        self.random = random
+        self.slerp = slerp
+        self.segment_frames = int(fps / speed) * 10
+        self.delta = speed / 450  # how far a component moves in one frame
+
+        self.latents = np.array(start, dtype=np.float64).reshape(1, -1)  # latents not used yet
+        self.last = self.latents[-1]  # the latent the next segment continues from
+
+    # the next n latents, shape (n, components), without using them up
+    def peek(self, n):
+        while len(self.latents) < n:
+            self.latents = np.concatenate((self.latents, self.next_segment()))
+        return self.latents[:n]
+
+    # use up the next n latents
+    def advance(self, n):
+        self.peek(n)
+        self.latents = self.latents[n:]
+
+    def next_segment(self):
+        frames = self.segment_frames
+        steps = np.arange(1, frames + 1)[:, None]
+
+        if self.transition == RANDOM:
+            # every frame, every component either goes up by delta, down by delta, or stays where it is
+            moves = np.array([0.0, self.delta, -self.delta])[self.random.randint(0, 3, size=(frames, len(self.last)))]
+            segment = self.last + np.cumsum(moves, axis=0)
+        elif self.transition == SEQUENCES:
+            # move smoothly from the last latent to a new random one
+            goal = self.random.randn(len(self.last))
+            if self.slerp:
+                segment = self.interpolate_sphere(self.last, goal, steps[:, 0] / frames)
+            else:
+                segment = self.last + (goal - self.last) * (steps / frames)
+        else:
+            # every component goes up by delta every frame
+            segment = self.last + self.delta * steps
+
+        self.last = segment[-1]
+        return segment
+
+    # spherical interpolation between latents a and b, a row for every fraction in t
+    @staticmethod
+    def interpolate_sphere(a, b, t):
+        cos_angle = np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+        angle = np.arccos(np.clip(cos_angle, -1.0, 1.0))
+        if np.sin(angle) < 1e-6:  # (almost) the same direction, a straight line is just as good
+            return a + (b - a) * t[:, None]
+        return (np.sin((1 - t) * angle)[:, None] * a + np.sin(t * angle)[:, None] * b) / np.sin(angle)
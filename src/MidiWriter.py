@@ -0,0 +1,92 @@
+import numpy as np
+
+from src.Synthesizer import Synthesizer
+
+
+# writes a standard midi file (format 1) with one track per voice. notes are given as arrays of keys and lengths in
+# the same form the Synthesizer takes, and a track can be written a part at a time, so the whole score never has to be
+# in memory. tracks are written one after another
+class MidiWriter:
+    TICKS_PER_QUARTER = 420  # divisible by every note length, so all notes are a whole number of ticks
+    TEMPO = 500000  # microseconds per quarter note, 120 bpm like the Synthesizer
+    VELOCITY = 80
+    LOWEST_KEY = 21  # midi key of a0, key 0 of the Synthesizer
+
+    def __init__(self, path, tracks):
+        self.file = open(path, 'wb')
+        self.file.write(b"MThd" + (6).to_bytes(4, 'big') + (1).to_bytes(2, 'big') + tracks.to_bytes(2, 'big') +
+                        MidiWriter.TICKS_PER_QUARTER.to_bytes(2, 'big'))
+        self.tracks = 0
+        self.track_start = None  # file position of the track being written
+        self.channel = 0
+        self.time = 0  # tick at the end of the notes written to the track so far
+        self.last_event = 0  # tick of the last event written to the track
+
+    # start the next track; channel is the midi channel its notes are played on
+    def start_track(self, name, channel=None):
+        self.track_start = self.file.tell()
+        self.file.write(b"MTrk" + bytes(4))  # the length is filled in by end_track
+        self.channel = self.tracks if channel is None else channel
+        self.time = 0
+        self.last_event = 0
+
+        name = name.encode('utf-8')
+        self.file.write(b"\x00\xff\x03" + bytes([len(name)]) + name)  # track name
+        if self.tracks == 0:
+            self.file.write(b"\x00\xff\x51\x03" + MidiWriter.TEMPO.to_bytes(3, 'big'))
+
+    # add notes to the end of the current track; keys are Synthesizer keys or Synthesizer.REST
+    def write_notes(self, keys, lengths):
+        ticks = 4 * MidiWriter.TICKS_PER_QUARTER // lengths
+        starts = self.time + np.concatenate(([0], np.cumsum(ticks)[:-1]))
+        self.time += int(ticks.sum())
+
+        played = keys != Synthesizer.REST
+        if not played.any():
+            return
+        # a note is released a little before the next one starts, like the pause of the Synthesizer
+        ons = starts[played]
+        offs = ons + np.round(ticks[played] * (1 - Synthesizer.PAUSE)).astype(np.int64)
+        times = np.stack((ons, offs), axis=1).ravel()
+        deltas = np.diff(times, prepend=self.last_event)
+        self.last_event = int(times[-1])
+
+        # every event is a variable length delta time of up to 4 bytes (7 bits per byte, all but the last byte with
+        # the top bit set) followed by note on or note off, key and velocity. events are built with every delta
+        # 4 bytes long, then the bytes the delta doesn't need are dropped
+        events = np.empty((len(times), 7), dtype=np.uint8)
+        for i, shift in enumerate((21, 14, 7, 0)):
+            events[:, i] = (deltas >> shift) & 0x7f
+        events[:, :3] |= 0x80
+        events[0::2, 4] = 0x90 | self.channel  # note on
+        events[1::2, 4] = 0x80 | self.channel  # note off
+        events[:, 5] = np.repeat(keys[played] + MidiWriter.LOWEST_KEY, 2)
+        events[0::2, 6] = MidiWriter.VELOCITY
+        events[1::2, 6] = 0
+
+        keep = np.ones(events.shape, dtype=bool)
+        for i, shift in enumerate((21, 14, 7)):
+            keep[:, i] = deltas >= 1 << shift
+        self.file.write(events[keep].tobytes())
+
+    # end the current track and fill in its length
+    def end_track(self):
+        # rests at the end of the track still take up time
+        self.file.write(self.variable_length(self.time - self.last_event) + b"\xff\x2f\x00")
+        end = self.file.tell()
+        self.file.seek(self.track_start + 4)
+        self.file.write((end - self.track_start - 8).to_bytes(4, 'big'))
+        self.file.seek(end)
+        self.tracks += 1
+
+    @staticmethod
+    def variable_length(value):
+        result = [value & 0x7f]
+        value >>= 7
+        while value > 0:
+            result.insert(0, (value & 0x7f) | 0x80)
+            value >>= 7
+        return bytes(result)
+
+    def close(self):
+        self.file.close()
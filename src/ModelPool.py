@@ -0,0 +1,137 @@
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import dnnlib.tflib as tflib
+import tensorflow as tf
+
+from src.GeneratorCache import GeneratorCache
+from src.globals import Globals
+
+
+# a gan model loaded from a pickle (or the GeneratorCache of one), with the tensorflow graph and session it lives in.
+# every model has a session of its own, so closing it frees the model's memory without touching the others
+class PooledModel:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()  # running a network can add operations to the graph, one thread at a time
+        self.users = 0  # jobs using the model; it is not unloaded while this is above 0
+
+        self.graph, self.session = (None, None)
+        if not (GeneratorCache.exists(path) and self.load_cache()):
+            self.load_pickle()
+        self.size = sum(int(np.prod(var.shape.as_list())) * var.dtype.size
+                        for network in (self.G, self.Gs) for var in network.vars.values())
+
+    @staticmethod
+    def new_session():
+        graph = tf.Graph()
+        with graph.as_default():
+            return graph, tflib.create_session()
+
+    # load the generators from the GeneratorCache into a new graph and session, replacing the ones the model had.
+    # returns whether it worked; if not, the model is left as it was
+    def load_cache(self):
+        graph, session = PooledModel.new_session()
+        try:
+            with graph.as_default(), session.as_default():
+                G, Gs = GeneratorCache.load(self.path)
+        except Exception as e:  # a stale or broken cache can fail in many ways, and the pickle is still there
+            print("can't load the generator cache of " + self.path + ", loading the model instead: " + str(e))
+            session.close()  # along with whatever was restored of the networks
+            return False
+
+        if self.session is not None:
+            self.session.close()
+        self.graph, self.session, self.G, self.Gs = (graph, session, G, Gs)
+        return True
+
+    # load the whole pickle into a new graph and session, and cache its generators for next time. the discriminator
+    # is loaded into the graph too, so once the cache is saved the generators are loaded again from it without it
+    def load_pickle(self):
+        self.graph, self.session = PooledModel.new_session()
+        with self.running():
+            with open(self.path, 'rb') as file:
+                self.G, _, self.Gs = pickle.load(file, encoding='latin1')  # (G, D, Gs)
+            try:
+                GeneratorCache.save(self.path, self.G, self.Gs)
+            except OSError as e:
+                print("can't save the generator cache of " + self.path + ": " + str(e))
+                return
+        self.load_cache()  # keeps the networks of the pickle if it fails
+
+    # run the model's networks, set its variables, etc. inside this
+    @contextmanager
+    def running(self):
+        with self.lock, self.graph.as_default(), self.session.as_default():
+            yield
+
+    # done with the model; it stays loaded for the next job until the pool needs the memory
+    def release(self):
+        ModelPool.release(self)
+
+    def close(self):
+        self.session.close()
+
+
+# gan models stay loaded between jobs, shared by every script in the program, so running a job on the same dataset
+# again doesn't load the model again. the least recently used models that no job is using are unloaded when the
+# loaded models take up more than Globals.gan_memory_capacity bytes
+class ModelPool:
+    _models = OrderedDict()  # path: PooledModel, least recently used first
+    _pending = {}  # path: event set when the thread loading that model is done
+    _lock = threading.Lock()
+
+    # the model saved at path, loading it if it isn't loaded yet. release it when done.
+    # models are loaded without holding the lock, so jobs using other models don't have to wait for the load
+    @staticmethod
+    def get(path):
+        while True:
+            with ModelPool._lock:
+                model = ModelPool._models.get(path)
+                if model is not None:
+                    ModelPool._models.move_to_end(path)
+                    model.users += 1
+                    return model
+
+                pending = ModelPool._pending.get(path)
+                if pending is None:
+                    # nobody is loading this model; this thread will
+                    pending = threading.Event()
+                    ModelPool._pending.update({path: pending})
+                    break
+
+            # another thread is already loading the same model, wait for it instead of loading it twice
+            pending.wait()
+
+        model = None
+        try:
+            model = PooledModel(path)
+        finally:
+            with ModelPool._lock:
+                if model is not None:
+                    ModelPool._models.update({path: model})
+                    model.users += 1
+                    ModelPool.evict()
+                ModelPool._pending.pop(path).set()
+        return model
+
+    @staticmethod
+    def release(model):
+        with ModelPool._lock:
+            model.users -= 1
+            ModelPool.evict()
+
+    # unload unused models, least recently used first, until the rest fit. models in use are never unloaded, even if
+    # that means going over the capacity
+    @staticmethod
+    def evict():
+        total = sum(model.size for model in ModelPool._models.values())
+        for path, model in list(ModelPool._models.items()):
+            if total <= Globals.gan_memory_capacity:
+                break
+            if model.users == 0:
+                del ModelPool._models[path]
+                model.close()
+                total -= model.size
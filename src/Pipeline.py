@@ -0,0 +1,97 @@
+import threading
+import time
+from queue import Queue, Empty, Full
+
+
+# one step of a Pipeline. function takes one item and returns the item passed on to the next stage
+class Stage:
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+        self.items = 0
+        self.busy = 0.0  # seconds spent inside function
+
+    # items per second this stage could handle if it never had to wait for the others
+    def throughput(self):
+        return self.items / self.busy if self.busy > 0 else 0.0
+
+
+# runs a source and a chain of stages concurrently, one thread each, connected by bounded queues.
+# items come out of every stage in the order they went in, and a full queue makes the stage before it wait, so at
+# most queue_size items are ever waiting between two stages
+class Pipeline:
+    _DONE = object()  # put in a queue after the last item
+
+    # source is an iterable of items; the first stage is the one that iterates over it
+    def __init__(self, source, stages, queue_size=8):
+        self.source = source
+        self.stages = stages
+        self.queues = [Queue(maxsize=queue_size) for _ in range(len(stages) - 1)]
+        self.stop = threading.Event()  # set when a stage fails, so the others stop waiting
+        self.error = None
+
+    # run all stages and wait for them to finish. the last stage's results are discarded
+    def run(self):
+        threads = [threading.Thread(target=self.run_stage, args=(i,), daemon=True) for i in range(len(self.stages))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def run_stage(self, index):
+        stage = self.stages[index]
+        inputs = iter(self.source) if index == 0 else self.iterate(self.queues[index - 1])
+        output = self.queues[index] if index < len(self.queues) else None
+
+        try:
+            while not self.stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(inputs)
+                except StopIteration:
+                    break
+                if index > 0:
+                    # time spent waiting for the stage before does not count.
+                    # the first stage does get the time spent pulling from the source, e.g. reading the input file
+                    start = time.perf_counter()
+                result = stage.function(item)
+                stage.busy += time.perf_counter() - start
+                stage.items += 1
+
+                if output is not None:
+                    self.put(output, result)
+        except Exception as e:
+            self.error = e
+            self.stop.set()
+
+        if output is not None:
+            self.put(output, Pipeline._DONE)
+
+    # get items from a queue until the stage before is done
+    def iterate(self, queue):
+        while not self.stop.is_set():
+            try:
+                item = queue.get(timeout=0.1)
+            except Empty:
+                continue
+            if item is Pipeline._DONE:
+                return
+            yield item
+
+    # put an item in a queue, giving up if the pipeline was stopped
+    def put(self, queue, item):
+        while not self.stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    # the throughput of every stage in one line, short enough for a status bar, e.g. "decode 310.2, render 24.3,
+    # encode 96.0 frames/s"
+    def report(self, unit="items"):
+        return ", ".join(stage.name + " " + str(round(stage.throughput(), 1)) for stage in self.stages) + " " + \
+            unit + "/s"
@@ -1,4 +1,6 @@
+import sys
 import threading
+from multiprocessing import get_context
 from time import sleep
 from src.File import File
 from src.exceptions import IncorrectFileType
@@ -78,6 +80,13 @@ class Script(threading.Thread):
         if self.output_file is not None:
             self.output_file.acquire_lock()
 
+    # the multiprocessing context pools of worker processes are made with. workers are forked on linux, so they start
+    # right away with the parent's memory (and anything passed to their initializer) instead of importing everything
+    # again. other platforms use their default, since forking is not safe there (macos) or not possible (windows)
+    @staticmethod
+    def process_context():
+        return get_context("fork" if sys.platform.startswith("linux") else None)
+
     # can be overridden by children
     def validate_arguments(self):
         pass
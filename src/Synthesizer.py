@@ -0,0 +1,182 @@
+import threading
+from math import cos, log, pi
+from os import replace
+from os.path import exists
+import numpy as np
+
+from src.globals import Globals
+
+
+# a piano-like synthesizer that sounds like tomita pysynth's make_wav, but renders every note once and keeps it.
+# a song is then built by copying the stored notes into one array instead of computing every sample in python.
+# the stored notes are saved in the working folder and memory-mapped on later loads
+class Synthesizer:
+    VERSION = 1
+    SAMPLE_RATE = 44100
+    KEYS = 88  # a0 to c8
+    LENGTHS = range(1, 9)  # note lengths that can be played; 4 is a quarter note, 2 a half note, etc.
+    REST = -1  # the key of a rest
+    PAUSE = 0.05  # part of a note's length that is silent, so notes don't run into each other
+
+    _synthesizer = None  # loaded once per process, shared by all scripts
+    _lock = threading.Lock()
+
+    # samples holds every note of every length one after another; the note of key k and length l starts at
+    # offsets[k, l] and ends at offsets[k, l] + sizes[k, l]
+    def __init__(self, samples, offsets, sizes):
+        self.samples = samples
+        self.offsets = offsets
+        self.sizes = sizes
+
+    @staticmethod
+    def load():
+        if Synthesizer._synthesizer is not None:
+            return Synthesizer._synthesizer  # no need to wait for the lock, which a forked process may never get
+        with Synthesizer._lock:
+            if Synthesizer._synthesizer is None:
+                samples_path = Globals.working_folder_path + "/synth_samples.npy"
+                table_path = Globals.working_folder_path + "/synth_table.npy"
+                if not exists(table_path) or np.load(table_path, mmap_mode='r')[0, 0] != Synthesizer.VERSION:
+                    Synthesizer.compile().save(samples_path, table_path)
+                Synthesizer._synthesizer = Synthesizer.open(samples_path, table_path)
+        return Synthesizer._synthesizer
+
+    # the frequency of a piano key, 0 being a0
+    @staticmethod
+    def frequency(key):
+        return 27.5 * 2.0 ** (key / 12.0)
+
+    # number of samples a note of this length takes up, including the pause after it
+    @staticmethod
+    def samples_per_length(length):
+        return 2 * Synthesizer.SAMPLE_RATE // length
+
+    # the sound of a single note, the same formula pysynth uses
+    @staticmethod
+    def render_note(hz, length):
+        b = (1.0 - Synthesizer.PAUSE) * Synthesizer.samples_per_length(length)
+        wave_length = Synthesizer.SAMPLE_RATE / hz
+        q = int(wave_length * round(b / Synthesizer.SAMPLE_RATE * hz))  # a whole number of waves
+
+        # harmonics are frequency-dependent
+        lf = log(hz)
+        lf_fac = (lf - 3.0) / 4.0
+        harm = 0 if lf_fac > 1 else 2.0 * (1 - lf_fac)
+        decay = 2.0 / lf
+        t = (lf - 3.0) / (8.5 - 3.0)
+        volfac = 1.0 + 0.8 * t * cos(pi / 5.3 * (lf - 3.0))
+
+        x = np.arange(q, dtype=np.float64)
+        # attack, then fade down to the sustain level, then release
+        fac = np.ones(q)
+        fac[:100] = x[:100] / 80.0
+        fac[100:300] = 1.25 - (x[100:300] - 100) / 800.0
+        release = x > q - 400
+        fac[release] = 1.0 - ((x[release] - q + 400) / 400.0)
+        s = x / q
+        dfac = 1.0 - s + s * decay
+
+        phase = 2.0 * pi * x / wave_length
+        wave = (np.sin(phase) + harm * np.sin(2 * phase) + 0.5 * harm * np.sin(4 * phase)) / 4.0
+        return np.clip(np.round(32000 * wave * fac * dfac * volfac), -32768, 32767).astype(np.int16)
+
+    # render every note of every length
+    @staticmethod
+    def compile():
+        notes = []
+        offsets = np.zeros((Synthesizer.KEYS, max(Synthesizer.LENGTHS) + 1), dtype=np.int64)
+        sizes = np.zeros_like(offsets)
+        position = 0
+        for key in range(Synthesizer.KEYS):
+            for length in Synthesizer.LENGTHS:
+                note = Synthesizer.render_note(Synthesizer.frequency(key), length)
+                offsets[key, length] = position
+                sizes[key, length] = len(note)
+                position += len(note)
+                notes.append(note)
+        return Synthesizer(np.concatenate(notes), offsets, sizes)
+
+    # the samples go in one file and the offsets and sizes in another, behind a row holding the version
+    def save(self, samples_path, table_path):
+        version = np.zeros((1, self.offsets.shape[1]), dtype=np.int64)
+        version[0, 0] = Synthesizer.VERSION
+        for path, data in ((samples_path, self.samples),
+                           (table_path, np.concatenate((version, self.offsets, self.sizes)))):
+            with open(path + ".tmp", 'wb') as f:
+                np.save(f, data)
+            replace(path + ".tmp", path)
+
+    @staticmethod
+    def open(samples_path, table_path):
+        table = np.load(table_path)
+        return Synthesizer(np.load(samples_path, mmap_mode='r'), table[1:Synthesizer.KEYS + 1],
+                           table[Synthesizer.KEYS + 1:])
+
+    # where every note of a song starts. like pysynth, a note that rings longer than its length delays the notes after
+    # it until the song catches up with its expected position. a song can be positioned a few notes at a time by
+    # passing the expected position and delay returned for the notes before; returns (starts, expected, delay) where
+    # the last two are those after the notes, so the song ends at expected + delay
+    def positions(self, keys, lengths, expected=0, delay=0):
+        lengths_in_samples = 2 * Synthesizer.SAMPLE_RATE // lengths
+        sounds = np.where(keys == Synthesizer.REST, lengths_in_samples, self.sizes[np.maximum(keys, 0), lengths])
+        # delay[i] = max(delay[i - 1] + sounds[i] - lengths_in_samples[i], 0), computed for all notes at once
+        overrun = np.cumsum(sounds - lengths_in_samples)
+        delays = overrun - np.minimum(np.minimum.accumulate(overrun), -delay)
+        ends = expected + np.cumsum(lengths_in_samples) + delays
+        starts = np.concatenate(([expected + delay], ends[:-1]))
+        if len(keys) == 0:
+            return starts[:0], expected, delay
+        return starts, expected + int(lengths_in_samples.sum()), int(delays[-1])
+
+    # render samples [start, end) of a song whose notes start at starts (from positions), so a long song can be
+    # rendered a piece at a time. notes never overlap, so only the notes starting before end have to be looked at
+    def render_part(self, keys, lengths, starts, start, end):
+        result = np.zeros(end - start, dtype=np.int16)
+        first = max(np.searchsorted(starts, start, side='right') - 1, 0)
+        last = np.searchsorted(starts, end)
+        for key, length, note_start in zip(keys[first:last], lengths[first:last], starts[first:last]):
+            if key != Synthesizer.REST:
+                offset = self.offsets[key, length]
+                # the part of the note that falls inside [start, end)
+                skip = max(start - note_start, 0)
+                size = min(self.sizes[key, length], end - note_start) - skip
+                if size > 0:
+                    position = note_start + skip - start
+                    result[position:position + size] = self.samples[offset + skip:offset + skip + size]
+        return result
+
+
+# one channel of a song that is rendered a piece at a time while its notes are still being added, e.g. a row of
+# pixels at a time. only the notes that have not been rendered completely are kept, so a song of any length takes the
+# same memory
+class Voice:
+    def __init__(self, synthesizer):
+        self.synthesizer = synthesizer
+        self.keys = np.empty(0, dtype=np.int64)
+        self.lengths = np.empty(0, dtype=np.int64)
+        self.starts = np.empty(0, dtype=np.int64)
+        self.expected = 0  # where the notes added so far end, and how far behind that the song is (see positions)
+        self.delay = 0
+        self.rendered = 0  # samples rendered so far
+
+    # number of samples the notes added so far take up
+    def end(self):
+        return self.expected + self.delay
+
+    def add(self, keys, lengths):
+        starts, self.expected, self.delay = self.synthesizer.positions(keys, lengths, self.expected, self.delay)
+        self.keys = np.concatenate((self.keys, keys))
+        self.lengths = np.concatenate((self.lengths, lengths))
+        self.starts = np.concatenate((self.starts, starts))
+
+    # the arguments of Synthesizer.render_part for the next samples up to end. notes that are done after that are
+    # forgotten; only the last note starting before end can still ring past it
+    def take(self, end):
+        first = max(np.searchsorted(self.starts, self.rendered, side='right') - 1, 0)
+        last = np.searchsorted(self.starts, end)
+        part = (self.keys[first:last], self.lengths[first:last], self.starts[first:last], self.rendered, end)
+
+        keep = max(last - 1, 0)
+        self.keys, self.lengths, self.starts = (self.keys[keep:], self.lengths[keep:], self.starts[keep:])
+        self.rendered = end
+        return part
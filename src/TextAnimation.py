@@ -0,0 +1,81 @@
+import sys
+import time
+import numpy as np
+
+# every frame starts with an application program command holding its duration; terminals ignore these, so printing
+# the whole file just shows the last frame, while a player can use them to time the frames
+FRAME_START = "\x1b_mmas;duration="
+FRAME_END = "\x1b\\"
+span_gap = 8  # changed characters closer together than this are rewritten as one span instead of moving the cursor
+
+
+# writes text frames to a file: the first frame in full, and after that only the parts of each frame that changed,
+# using escape codes to move the cursor to them
+class TextAnimationWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.previous = None  # character codes of the last frame
+        self.frames = 0
+        # milliseconds the frames so far should take, and what their written (whole millisecond) durations add up to.
+        # every frame gets the rounding error of the ones before it, so e.g. 30 fps doesn't drift to 1000 / 33
+        self.time = 0.0
+        self.written_time = 0
+
+    # add a frame, given as a grid of character codes (height x width), shown for duration milliseconds
+    def write(self, codes, duration):
+        self.time += duration
+        written = int(round(self.time)) - self.written_time
+        self.written_time += written
+        self.file.write(FRAME_START + str(written) + FRAME_END)
+
+        if self.previous is None or self.previous.shape != codes.shape:
+            # key frame: clear the screen and write everything
+            self.file.write("\x1b[H\x1b[2J")
+            lines = np.empty((codes.shape[0], codes.shape[1] + 1), dtype='<u4')
+            lines[:, :-1] = codes
+            lines[:, -1] = ord("\n")
+            self.file.write(lines.tobytes().decode('utf-32-le'))
+        else:
+            changed = codes != self.previous
+            for row in np.flatnonzero(changed.any(axis=1)):
+                columns = np.flatnonzero(changed[row])
+                # split the changed columns of this row into spans wherever there is a long unchanged gap
+                breaks = np.flatnonzero(np.diff(columns) > span_gap)
+                starts = np.concatenate(([columns[0]], columns[breaks + 1]))
+                ends = np.concatenate((columns[breaks], [columns[-1]])) + 1
+                for start, end in zip(starts, ends):
+                    span = np.ascontiguousarray(codes[row, start:end], dtype='<u4').tobytes().decode('utf-32-le')
+                    self.file.write("\x1b[" + str(row + 1) + ";" + str(start + 1) + "H" + span)
+
+        self.previous = np.array(codes, dtype='<u4')
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+
+# play an animation written by TextAnimationWriter in the terminal
+def play(path, loop=False, output=sys.stdout):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        frames = f.read().split(FRAME_START)[1:]
+
+    output.write("\x1b[?25l")  # hide cursor
+    try:
+        while True:
+            next_frame = time.perf_counter()
+            for frame in frames:
+                duration, text = frame.split(FRAME_END, 1)
+                output.write(text)
+                output.flush()
+                # sleep until the frame's time is up instead of busy waiting
+                next_frame += int(duration) / 1000
+                time.sleep(max(next_frame - time.perf_counter(), 0))
+            if not loop:
+                break
+    finally:
+        output.write("\x1b[?25h")  # show cursor again
+
+
+if __name__ == "__main__":
+    # python -m src.TextAnimation path/to/animation.txt [--loop]
+    play(sys.argv[1], loop="--loop" in sys.argv[2:])
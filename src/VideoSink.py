@@ -0,0 +1,38 @@
+import ffmpeg
+import numpy as np
+
+from src.exceptions import EncodingError
+from src.globals import Globals
+
+
+# encodes frames into a video file with a single ffmpeg process. frames are piped to ffmpeg as raw pixels, and the
+# audio of another file can be copied into the result in the same pass, so nothing is written to disk twice
+class VideoSink:
+    # size is (width, height); pixel_format is the layout of the arrays passed to write, e.g. "rgb24" or "bgr24".
+    # codec, preset and threads default to the values in Globals
+    def __init__(self, path, size, fps, pixel_format="rgb24", audio_path=None, codec=None, preset=None,
+                 threads=None):
+        width, height = size
+        video = ffmpeg.input('pipe:', format='rawvideo', pix_fmt=pixel_format, s=str(width) + "x" + str(height),
+                             r=fps)
+        # most players only support yuv420p, which needs an even width and height
+        streams = [video.filter('pad', 'ceil(iw/2)*2', 'ceil(ih/2)*2')]
+        if audio_path is not None:
+            streams.append(ffmpeg.input(audio_path)['a?'])  # copy the audio if there is any
+
+        output = ffmpeg.output(*streams, path, vcodec=codec or Globals.video_codec, pix_fmt='yuv420p',
+                               preset=preset or Globals.video_preset,
+                               threads=Globals.video_threads if threads is None else threads, acodec='copy')
+        # keep ffmpeg quiet; its progress output is not read and would eventually fill the pipe
+        self.process = output.overwrite_output()\
+            .run_async(cmd=['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostats'], pipe_stdin=True)
+
+    # write one frame, an array of shape (height, width, channels)
+    def write(self, frame):
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+
+    # finish encoding and wait for ffmpeg to exit
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise EncodingError("ffmpeg exited with code " + str(self.process.returncode))
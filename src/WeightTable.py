@@ -0,0 +1,176 @@
+import threading
+from os import replace
+from os.path import basename, dirname, exists, getmtime
+import numpy as np
+
+from src.globals import Globals
+
+
+# the characters of a weights.txt file compiled into flat arrays, so a whole image can be mapped to characters with
+# a few numpy indexing operations instead of searching for the closest weight pixel by pixel.
+# the compiled table is saved in the working folder as a single .npy file and memory-mapped on later loads
+class WeightTable:
+    VERSION = 1
+
+    # what to do when the closest populated weights above and below an empty weight are equally far away
+    TIE_RANDOM = 0
+    TIE_DARKER = 1
+    TIE_LIGHTER = 2
+
+    # layout of the compiled file: a header, then the nearest weight table, offsets, counts, and characters
+    HEADER = 4  # version, tie policy, number of characters, unused
+    NEAREST = HEADER
+    OFFSETS = NEAREST + 512
+    COUNTS = OFFSETS + 256
+    CHARACTERS = COUNTS + 256
+
+    _tables = {}  # tables already loaded by this process, shared by all scripts
+    _lock = threading.Lock()
+
+    # characters is the array of all character codes, grouped by weight; offsets[w] is the index of the first
+    # character with weight w and counts[w] is how many characters have weight w. nearest[intent] holds the darker
+    # and the lighter populated weight closest to intent; they are equal unless both are equally far away
+    def __init__(self, nearest, offsets, counts, characters, tie=TIE_RANDOM):
+        self.nearest = nearest
+        self.offsets = offsets
+        self.counts = counts
+        self.characters = characters
+        self.tie = tie
+
+    # get the table for a weights.txt file, compiling it if it was never compiled, the text file changed since, or it
+    # was compiled by another version
+    @staticmethod
+    def load(path, tie=TIE_RANDOM):
+        with WeightTable._lock:
+            table = WeightTable._tables.get((path, tie))
+            if table is None:
+                compiled_path = WeightTable.compiled_path(path, tie)
+                if exists(compiled_path) and getmtime(compiled_path) >= getmtime(path):
+                    table = WeightTable.open(compiled_path)
+                if table is None or table.tie != tie:
+                    WeightTable.compile(path, tie).save(compiled_path)
+                    table = WeightTable.open(compiled_path)
+                WeightTable._tables.update({(path, tie): table})
+        return table
+
+    # where the compiled version of a weights file is kept, e.g. res/working_folder/ascheatfy_weights_0.npy.
+    # every tie policy has a file of its own
+    @staticmethod
+    def compiled_path(path, tie=TIE_RANDOM):
+        name = basename(dirname(path)) + "_" + basename(path).split(".")[0] + "_" + str(tie)
+        return Globals.working_folder_path + "/" + name + ".npy"
+
+    # build a table from a weights.txt file
+    @staticmethod
+    def compile(path, tie=TIE_RANDOM):
+        weights = [[] for _ in range(256)]  # there are 256 possible values (0-255)
+        with open(path, 'r') as f:
+            for line in f.readlines():  # one line per weight, each line lists characters with that weight
+                n, p = (int(line.split(": ")[0]), line.split(": ")[1])
+                weights[n] = list(map(int, p.split(" ")))
+
+        counts = np.array([len(characters) for characters in weights], dtype=np.int32)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int32)
+        characters = np.array([c for characters in weights for c in characters], dtype=np.int32)
+        return WeightTable(WeightTable.build_nearest(counts, tie), offsets, counts, characters, tie)
+
+    # because not all weight values have characters, every weight is mapped to the closest weight that does
+    @staticmethod
+    def build_nearest(counts, tie=TIE_RANDOM):
+        populated = np.flatnonzero(counts)
+        nearest = np.empty((256, 2), dtype=np.int32)
+        for intent in range(256):
+            if counts[intent] > 0:
+                nearest[intent] = (intent, intent)
+                continue
+
+            darker = populated[populated < intent]
+            lighter = populated[populated > intent]
+            dark = intent - darker[-1] if len(darker) > 0 else -1
+            light = lighter[0] - intent if len(lighter) > 0 else -1
+
+            if dark == -1:
+                nearest[intent] = (intent + light, intent + light)
+            elif light == -1:
+                nearest[intent] = (intent - dark, intent - dark)
+            elif light == dark:
+                if tie == WeightTable.TIE_DARKER:
+                    nearest[intent] = (intent - dark, intent - dark)
+                elif tie == WeightTable.TIE_LIGHTER:
+                    nearest[intent] = (intent + light, intent + light)
+                else:
+                    nearest[intent] = (intent - dark, intent + light)
+            elif light < dark:
+                nearest[intent] = (intent + light, intent + light)
+            else:
+                nearest[intent] = (intent - dark, intent - dark)
+        return nearest
+
+    # write the table to a single .npy file. written to a temporary file first so a concurrent load never sees a
+    # half-written table
+    def save(self, path):
+        header = np.array([WeightTable.VERSION, self.tie, len(self.characters), 0], dtype=np.int32)
+        data = np.concatenate((header, self.nearest.ravel(), self.offsets, self.counts, self.characters))
+        with open(path + ".tmp", 'wb') as f:
+            np.save(f, data.astype(np.int32))
+        replace(path + ".tmp", path)
+
+    # memory-map a compiled table; the arrays are read-only views into the file. returns None if the file can't be
+    # read or was saved by another version
+    @staticmethod
+    def open(path):
+        try:
+            data = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if len(data) < WeightTable.CHARACTERS or data[0] != WeightTable.VERSION:
+            return None
+        _, tie, length = data[:3]
+        return WeightTable(data[WeightTable.NEAREST:WeightTable.OFFSETS].reshape(256, 2),
+                           data[WeightTable.OFFSETS:WeightTable.COUNTS],
+                           data[WeightTable.COUNTS:WeightTable.CHARACTERS],
+                           data[WeightTable.CHARACTERS:WeightTable.CHARACTERS + length], int(tie))
+
+    # pick a single character for each weight to keep palette consistent.
+    # if this method is not called pixels with the same brightness may be different characters
+    def limit_palette(self, rng):
+        picks = self.offsets + (rng.random(256) * self.counts).astype(np.int32)
+        counts = np.minimum(self.counts, 1)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int32)
+        return WeightTable(self.nearest, offsets, counts, self.characters[picks[counts > 0]], self.tie)
+
+    # map a grid of weights (uint8 array) to the closest weights that have characters
+    def true_weights(self, weights, rng):
+        if self.tie == WeightTable.TIE_RANDOM:
+            return self.nearest[weights, rng.integers(0, 2, size=weights.shape)]
+        return self.nearest[weights, 0]
+
+    # map a grid of weights to indices into self.characters, picking a random character of the right weight
+    def character_indices(self, weights, rng):
+        true = self.true_weights(weights, rng)
+        return self.offsets[true] + (rng.random(weights.shape) * self.counts[true]).astype(np.int32)
+
+    # like character_indices, but the character picked for a cell only depends on seed, the cell's position and its
+    # weight, not on the cells or frames before it. frames converted with the same seed keep the character of every
+    # cell whose weight didn't change, however they are split between processes
+    def stable_character_indices(self, weights, seed):
+        h, w = weights.shape
+        cells = np.arange(h * w, dtype=np.uint64).reshape(h, w) * np.uint64(256) + weights.astype(np.uint64)
+        bits = WeightTable.mix(cells + WeightTable.mix(np.full(1, seed, dtype=np.uint64)))
+        if self.tie == WeightTable.TIE_RANDOM:
+            true = self.nearest[weights, (bits & np.uint64(1)).astype(np.intp)]
+        else:
+            true = self.nearest[weights, 0]
+        fraction = (bits >> np.uint64(11)).astype(np.float64) / float(1 << 53)  # the top 53 bits, in [0, 1)
+        return self.offsets[true] + (fraction * self.counts[true]).astype(np.int32)
+
+    # scramble an array of uint64 so that close values end up far apart (the finalizer of splitmix64)
+    @staticmethod
+    def mix(x):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
+
+    # map a grid of weights directly to character codes
+    def lookup(self, weights, rng):
+        return self.characters[self.character_indices(weights, rng)]
@@ -6,3 +6,8 @@ class FileLockedError(Exception):
 # the file is of incorrect type / extension
 class IncorrectFileType(Exception):
     pass
+
+
+# ffmpeg failed to encode the output
+class EncodingError(Exception):
+    pass
@@ -7,6 +7,12 @@ from src.exceptions import FileLockedError
 
 class Globals:
     working_folder_path = "res/working_folder"  # folder where some temporary things will be stored
+    video_codec = "libx264"  # codec, ffmpeg preset and encoder threads (0 for automatic) used to write videos
+    video_preset = "medium"
+    video_threads = 0
+    audio_codec = "libmp3lame"  # codec and bitrate used to write audio
+    audio_bitrate = "192k"
+    gan_memory_capacity = 4 * 1024 * 1024 * 1024  # bytes of gan models kept loaded between jobs
     gui = None
     files_in_use = set()
     file_lock = threading.Lock()  # only one thread can access the file set at the same time
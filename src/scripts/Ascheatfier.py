@@ -1,72 +1,111 @@
-import random
+from collections import deque
 import cv2
-from cv2 import VideoCapture, VideoWriter, VideoWriter_fourcc
-from PIL import Image, ImageChops, ImageDraw, ImageFont
-import ffmpeg
-from numpy import array
+from cv2 import VideoCapture
+from multiprocessing import cpu_count
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageSequence
+from numpy import asarray, empty, ndarray, stack, uint8
+from numpy.random import default_rng
 
 from src.File import File
+from src.GlyphAtlas import GlyphAtlas, IncrementalRenderer
+from src.GifWriter import GifWriter
+from src.GlyphCache import GlyphCache
+from src.Pipeline import Pipeline, Stage
+from src.WeightTable import WeightTable
 from src.Script import Script, OptionList
-from src.globals import Globals
+from src.VideoSink import VideoSink
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:  # python 3.7; huge images are rendered in this process like any other
+    SharedMemory = None
 
 W, H = (11, 18)  # width and height of one character
-font = ImageFont.truetype("DejaVuSansMono-Bold.ttf", 18, encoding='utf-8')
+font_path = "res/ascheatfy/DejaVuSansMono-Bold.ttf"
+font_size = 18
+font = None  # only loaded when a character has to be drawn; most jobs get their characters from the GlyphCache
+queue_size = 8  # frames waiting between two stages of a video conversion
+band_cells = 300 * 300  # images with more characters than this are rendered in bands by several processes
 
 Resolution = OptionList({
     "small (50)": 50,
     "medium (150)": 150,
-    "big (300)": 300
+    "big (300)": 300,
+    "huge (1000)": 1000,
+    "print (2000)": 2000
 })
 
 
+# glyphs and options of a gif worker process, set once by init_gif_worker so they are not sent with every frame
+gif_worker = None
+
+
+def init_gif_worker(table, char_images, mode, resolution, white_on_black):
+    global gif_worker
+    gif_worker = (GlyphAtlas(table, char_images, mode), resolution, white_on_black)
+
+
+# convert one gif frame in a worker process, or in this one if worker (what init_gif_worker sets) is given.
+# every frame of a gif uses the same seed, so a character only changes where the frame did
+def asciify_gif_frame(job, worker=None):
+    frame, seed = job
+    atlas, resolution, white_on_black = worker or gif_worker
+    weights = Ascheatfier.get_weights(frame, resolution, white_on_black)
+    return atlas.render(atlas.stable_glyph_indices(weights, seed))
+
+
+# glyphs and the shared result image of a band worker process, set once by init_band_worker
+band_worker = None
+
+
+def init_band_worker(char_images, mode, memory_name, shape):
+    global band_worker
+    memory = SharedMemory(name=memory_name)
+    band_worker = (GlyphAtlas(None, char_images, mode), memory, ndarray(shape, dtype=uint8, buffer=memory.buf))
+
+
+# render the characters of rows [start, end) of the image straight into the shared result
+def render_band(job):
+    start, indices = job
+    atlas, _, result = band_worker
+    atlas.render(indices, out=result[start * atlas.H:(start + len(indices)) * atlas.H])
+    return len(indices)
+
+
 # transforms image into image of characters
 class Ascheatfier(Script):
-    def __init__(self, input_path, output_path, resolution, static, white_on_black):
+    def __init__(self, input_path, output_path, resolution, static, white_on_black, seed=None, processes=None,
+                 incremental=False, hysteresis=0, monochrome=None):
         super().__init__(input_path, output_path)
 
         self._script_name = "Ascheatfy"
-        self._input_types = [File.Types.PNG, File.Types.MP4]  # allowed input types
+        self._input_types = [File.Types.PNG, File.Types.GIF, File.Types.MP4]  # allowed input types
         self._output_type = File.Types.MATCH_INPUT  # output type. if "MATCH_INPUT", is the same as input type
 
         self.static = static
         self.white_on_black = white_on_black
         self.resolution = Resolution.get_option_value(resolution)
-
-        self.char_images = {}
+        self.processes = processes  # processes converting gif frames; None to use every core
+        # videos only: redraw only the characters whose weight changed by more than hysteresis since they were drawn
+        self.incremental = incremental
+        self.hysteresis = hysteresis
+        # GlyphAtlas.L or GlyphAtlas.P to render one channel images instead of rgba; videos are always L
+        self.monochrome = monochrome
+
+        self.table = None
+        self.char_images = None  # array with one image per character in self.table
+        self.atlas = None
+        self.random = default_rng(seed)  # the same seed always picks the same characters
 
         self.start()
 
-    # build weights, an array of arrays, from res/ascheatfy/weights.txt
-    def read_weights(self):
-        weights = []
-
-        # there are 256 possible values (0-255). prepare a spot on the list for each
-        for i in range(256):
-            weights.append("")
-
-        with open('res/ascheatfy/weights.txt', 'r') as f:
-            lines = f.readlines()  # one line per weight, each line lists characters with that weight
-            for line in lines:
-                n, p = (int(line.split(": ")[0]), line.split(": ")[1])
-                weights[n] = list(map(int, p.split(" ")))
-
-        if self.static:
-            weights = self.limit_palette(weights)
-
-        return weights
-
-    # pick a single character for each weight to keep palette consistent.
-    # if this method is not called pixels with the same brightness may be different characters
-    @staticmethod
-    def limit_palette(weights):
-        for w in range(len(weights)):
-            if len(weights[w]) > 1:
-                weights[w] = [random.choice(weights[w])]
-        return weights
-
     # i probably copy-pasted some of this function from stackoverflow
     # generate the ascheatfied image
     def generate_image(self, character):
+        global font
+        if font is None:
+            font = ImageFont.truetype(font_path, font_size, encoding='utf-8')
+
         img = Image.new("RGBA", (W, H), (0, 0, 0) if self.white_on_black else (255, 255, 255))
         draw = ImageDraw.Draw(img)
         offset_w, offset_h = font.getoffset(chr(character))
@@ -75,13 +114,24 @@ class Ascheatfier(Script):
         draw.text(pos, chr(character), "white" if self.white_on_black else "black", font=font)  # draw the character
         return img
 
-    # generate an image of each character and save in self.char_images
+    # generate an image of each character as one array
+    def generate_images(self, characters):
+        return stack([asarray(self.generate_image(c).convert("RGBA")) for c in characters])
+
+    # load the weights from res/ascheatfy/weights.txt and get an image of each character in self.char_images.
+    # the images of all characters are cached, so a static palette just picks its characters out of them
     def generate_character_images(self):
-        weights = self.read_weights()
-        for w in range(256):  # for each weight value
-            self.char_images.update({w: {}})
-            for c in weights[w]:  # for each character that has this weight
-                self.char_images.get(w).update({c: self.generate_image(c)})
+        table = WeightTable.load('res/ascheatfy/weights.txt')
+        char_images = GlyphCache.get(font_path, font_size, (W, H), self.white_on_black, GlyphAtlas.RGBA,
+                                     table.characters, self.generate_images)
+
+        if self.static:
+            self.table = table.limit_palette(self.random)
+            index = {c: i for i, c in enumerate(table.characters)}
+            self.char_images = char_images[[index[c] for c in self.table.characters]]
+        else:
+            self.table = table
+            self.char_images = char_images
 
     # return the size a resized image would be; for asciify_mp4 method
     def get_resized_size(self, size):
@@ -101,7 +151,8 @@ class Ascheatfier(Script):
         return int(w)*W, int(h)*H
 
     # resize the image so that each pixel maps to one character
-    def resize_image(self, image):
+    @staticmethod
+    def resize_image(image, resolution):
         w, h = image.size
 
         # the character images are W*H pixels; must stretch image so when converted the two stretches cancel out
@@ -110,164 +161,173 @@ class Ascheatfier(Script):
 
         ratio = h / w
         if ratio > 0:  # height was > width
-            w = self.resolution
+            w = resolution
             h = w * ratio
         else:
-            h = self.resolution
+            h = resolution
             w = h / ratio
 
         image = image.resize((int(w), int(h)), resample=Image.LANCZOS)
         return image
 
-    # find the first weight that contains characters lighter than intent
-    def find_lighter(self, intent):
-        d = 0
-        while intent + d <= 255 and len(self.char_images.get(intent + d).values()) == 0:
-            d += 1
-        if intent + d > 255:
-            return -1
-        elif len(self.char_images.get(intent + d).values()) != 0:
-            return d
-
-    # find the first weight that contains characters darker than intent
-    def find_darker(self, intent):
-        d = 0
-        while intent - d >= 0 and len(self.char_images.get(intent - d).values()) == 0:
-            d += 1
-        if intent - d < 0:
-            return -1
-        elif len(self.char_images.get(intent - d).values()) != 0:
-            return d
-
-    # because not all weight values have characters, i have to find the closest weight that does
-    def get_true_weight(self, intent):
-        true = 0
-
-        if len(self.char_images.get(intent).values()) > 0:
-            true = intent
-        else:
-            light = self.find_lighter(intent)
-            dark = self.find_darker(intent)
-
-            if dark == -1:
-                true = intent + light
-            elif light == -1:
-                true = intent - dark
-            else:
-                if light == dark:
-                    true = random.choice([intent + light, intent - dark])
-                elif light < dark:
-                    true = intent + light
-                elif dark < light:
-                    true = intent - dark
-
-        return true
-
-    # convert a single image into an ascheatfied image and return the result
-    def asciify(self, image, silent=False):
-        image = self.resize_image(image)
-
-        # create result image; W*H px rectangle for each pixel in source image
-        w, h = image.size
-        result = Image.new("RGBA", (w * W, h * H), "black" if self.white_on_black else "white")
-        if not silent:
-            self.preview.put_image(image=result)
+    # build the glyph atlas used by asciify; mode is the channel layout the output needs, by default the monochrome
+    # mode if there is one and rgba otherwise
+    def build_atlas(self, mode=None):
+        self.atlas = GlyphAtlas(self.table, self.char_images, mode=mode or self.monochrome or GlyphAtlas.RGBA)
+
+    # resize the image and get the weight of every pixel, as an array
+    @staticmethod
+    def get_weights(image, resolution, white_on_black):
+        image = Ascheatfier.resize_image(image, resolution)
 
         # the first version of asciify was meant for viewing in dark mode (white text on black background)
         # by default lighter pixels become denser characters
         # must invert image to ensure values are correct when viewed in black characters on white background
-        if not self.white_on_black:
+        if not white_on_black:
             image = ImageChops.invert(image)
 
-        image = image.convert('L')  # black and white
+        return asarray(image.convert('L'))  # black and white
 
-        # loop over pixels in source image
-        for hi in range(h):
-            for wi in range(w):
-                weight = self.get_true_weight(image.getpixel((wi, hi)))
-                char_img = self.char_images.get(weight).get(random.choice(list(self.char_images.get(weight).keys())))
-                result.alpha_composite(char_img, dest=(wi * W, hi * H))
-            if not silent:
-                self.preview.put_image(image=result)
-                self.preview.progress_amount(90 * hi / h)
+    # convert a single image into an ascheatfied image and return the result as an array of pixels.
+    # the result is written into out if given; otherwise the array is reused for the next frame, so it must be copied
+    # if it has to be kept. rng picks the characters, self.random by default
+    def asciify(self, image, silent=False, out=None, rng=None):
+        weights = self.get_weights(image, self.resolution, self.white_on_black)
+
+        # pick a character for every pixel and paste them all into the result at once
+        indices = self.atlas.glyph_indices(weights, self.random if rng is None else rng)
+        result = self.atlas.render(indices, out=out)
+        if not silent:
+            self.preview.put_image(image=self.atlas.to_image(result))
 
         return result
 
-    # have to convert a video. convert each frame as if it were an image
+    # have to convert a video. convert each frame as if it were an image. returns how fast every step went
     def convert_mp4(self):
         self.preview.progress_update("processing video...")
+        # the same channel order opencv reads frames in, or gray, which ffmpeg can take as it is
+        self.build_atlas(GlyphAtlas.L if self.monochrome else GlyphAtlas.BGR)
         video = VideoCapture(self.input_file.get_full_path())
-        result = VideoWriter(Globals.working_folder_path + "\\video.mp4",
-                             VideoWriter_fourcc('m', 'p', '4', 'v'), video.get(cv2.CAP_PROP_FPS),
-                             self.get_resized_size((int(video.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                                                   int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)))))
+        width, height = self.get_resized_size((int(video.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                               int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))))
+        # frames go straight to ffmpeg, which copies the audio of the input in the same pass
+        result = VideoSink(self.output_file.get_full_path(), (width, height), video.get(cv2.CAP_PROP_FPS),
+                           pixel_format="gray" if self.monochrome else "bgr24",
+                           audio_path=self.input_file.get_full_path())
         frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
         self.preview.progress_amount(10)
 
+        # reading, ascheatfying and writing frames each run on their own thread
         self.preview.progress_update("ascheatfying...")
-        index = 0
-        while video.isOpened():
-            ret, cv2_im = video.read()  # i think ret is short for retrieved; boolean, false when no more frames
-            if ret:
-                # convert from numpy array to pillow image
-                frame_image = Image.fromarray(cv2.cvtColor(cv2_im, cv2.COLOR_BGR2RGB))
-
-                asciified = self.asciify(frame_image.convert("RGB"), silent=True)  # tell method not to update preview
-                self.preview.put_image(image=asciified)
-
-                # convert back from pillow image to numpy array
-                frame_array = cv2.cvtColor(array(asciified), cv2.COLOR_RGB2BGR)
-                result.write(frame_array)  # write method takes numpy array as parameter
-                self.preview.progress_amount(10 + index * 80 / frame_count)
-
-                index += 1
-
-            elif not ret:
-                break
-
-        video.release()
-        result.release()
-
-        # add the audio
-        self.preview.progress_update("processing audio...")
-        audio = ffmpeg.input(self.input_file.get_full_path()).audio
-        video = ffmpeg.input(Globals.working_folder_path+"\\video.mp4").video
-        ffmpeg.output(audio, video, self.output_file.get_full_path())\
-            .overwrite_output()\
-            .run(quiet=True)
+        # every frame is rendered into the next buffer of the ring. there are enough buffers that one is never reused
+        # while the frame in it is still waiting to be written
+        buffers = [empty((height, width, self.atlas.channels), dtype=uint8) for _ in range(queue_size + 3)]
+        index = [0, 0]  # frames rendered, frames written
+        renderer = IncrementalRenderer(self.atlas, self.hysteresis) if self.incremental else None
+
+        def read_frames():
+            while video.isOpened():
+                ret, cv2_im = video.read()  # i think ret is short for retrieved; boolean, false when no more frames
+                if not ret:
+                    break
+                yield cv2_im
+
+        def decode(cv2_im):
+            # convert from numpy array to pillow image
+            return Image.fromarray(cv2.cvtColor(cv2_im, cv2.COLOR_BGR2RGB))
+
+        def render(frame_image):
+            out = buffers[index[0] % len(buffers)]
+            index[0] += 1
+            if renderer is not None:
+                weights = self.get_weights(frame_image, self.resolution, self.white_on_black)
+                return renderer.render(weights, self.random, out=out)
+            return self.asciify(frame_image, silent=True, out=out)  # tell method not to update preview
+
+        def encode(asciified):
+            result.write(asciified)
+
+            # update preview once every 10 frames
+            if index[1] % 10 == 0:
+                self.preview.put_image(image=self.atlas.to_image(asciified))
+                self.preview.progress_amount(10 + index[1] * 80 / frame_count)
+            index[1] += 1
+
+        pipeline = Pipeline(read_frames(), [Stage("decode", decode), Stage("render", render), Stage("encode", encode)],
+                            queue_size=queue_size)
+        try:
+            pipeline.run()
+        finally:
+            video.release()
+            self.preview.progress_update("saving video...")
+            result.close()
+
+        # shown with the final status
+        summary = pipeline.report("frames")
+        if renderer is not None:
+            summary += ", " + str(round(100 * renderer.redrawn(), 1)) + "% of characters redrawn"
+        return summary
 
     # have to convert a gif. convert each frame as if it were an image
     def convert_gif(self):
-        # must loop once to find total number of frames for updating the progress bar. also get durations while at it
         self.preview.progress_update("processing gif...")
-        frame = Image.open(self.input_file.get_full_path())
-        durations = []
-        frame_count = 0
-        try:
-            while 1:
-                durations.append(frame.info['duration'])
-                frame_count += 1
-                frame.seek(frame.tell() + 1)
-        except EOFError:
-            pass  # do nothing
+        gif = Image.open(self.input_file.get_full_path())
+        frame_count = gif.n_frames
+        # the characters are picked from the seed and the cell instead of one random generator shared by the frames,
+        # so the result does not depend on which process converts which frame, and unchanged parts of the gif stay
+        # the same from frame to frame, which GifWriter then leaves out
+        seed = int(self.random.integers(1 << 62))
         self.preview.progress_amount(10)
 
         self.preview.progress_update("ascheatfying...")
-        result_frames = []
-        frame = Image.open(self.input_file.get_full_path())
+        self.build_atlas()
+        processes = min(self.processes or cpu_count(), frame_count)
+        if processes > 1:
+            # frames are independent, convert them in a pool of processes that each have their own copy of the glyphs
+            pool = self.process_context().Pool(processes, initializer=init_gif_worker,
+                                               initargs=(self.table, self.char_images, self.atlas.mode,
+                                                         self.resolution, self.white_on_black))
+            in_flight = 2 * processes  # frames being converted while the oldest one is written
+        else:
+            pool = None
+            in_flight = 0  # the atlas reuses its result array, so every frame has to be written before the next
+        pending = deque()  # (converted frame, or its pool result, and duration) of frames not written yet, in order
+
+        # frames are decoded only when there is room for them and written as soon as they are converted, so only a few
+        # of them are in memory at a time, however long the gif is.
+        # one channel frames already index into a fixed palette, so they don't need to be quantized
+        result = GifWriter(self.output_file.get_full_path(), loop=0, palette=self.atlas.palette())
+        written = [0]
+
+        # write the oldest frame not written yet, waiting for it to be converted
+        def write_next():
+            asciified, duration = pending.popleft()
+            if pool is not None:
+                asciified = asciified.get()
+            result.write(asciified, duration)
+            self.preview.put_image(image=self.atlas.to_image(asciified))
+            self.preview.progress_amount(10 + written[0] * 80 / frame_count)
+            written[0] += 1
+
         try:
-            while 1:
-                asciified = self.asciify(frame.convert("RGB"), silent=True)  # tell method not to update preview
-                result_frames.append(asciified)
-                self.preview.put_image(image=asciified)
-                self.preview.progress_amount(10 + frame.tell() * 80 / frame_count)
-                frame.seek(frame.tell() + 1)
-        except EOFError:
-            pass  # eof, do nothing
-
-        self.preview.progress_update("saving gif...")
-        result_frames[0].save(self.output_file.get_full_path(), format='GIF', append_images=result_frames[1:],
-                              save_all=True, duration=durations, loop=0)
+            for frame in ImageSequence.Iterator(gif):
+                duration = frame.info['duration']
+                job = (frame.convert("RGB"), seed)
+                if pool is not None:
+                    pending.append((pool.apply_async(asciify_gif_frame, (job,)), duration))
+                else:
+                    pending.append((asciify_gif_frame(job, (self.atlas, self.resolution, self.white_on_black)),
+                                    duration))
+                while len(pending) > in_flight:
+                    write_next()
+            while pending:
+                write_next()
+        finally:
+            if pool is not None:
+                pool.terminate()
+            gif.close()
+            self.preview.progress_update("saving gif...")
+            result.close()
 
     # ascheatfy a single image
     def convert_image(self):
@@ -277,23 +337,61 @@ class Ascheatfier(Script):
         image = Image.open(self.input_file.get_full_path()).convert("RGB")
 
         self.preview.progress_update("ascheatfying...")
-        result = self.asciify(image)
-        self.preview.progress_amount(90)
-
-        self.preview.progress_update("saving image")
-        # save image in a png file in destination folder
-        result.save(fp=self.output_file.get_full_path())
+        self.build_atlas()
+        weights = self.get_weights(image, self.resolution, self.white_on_black)
+        processes = min(self.processes or cpu_count(), weights.shape[0])
+        if weights.size <= band_cells or processes <= 1 or SharedMemory is None:
+            result = self.asciify(image)
+            self.preview.progress_amount(90)
+
+            self.preview.progress_update("saving image")
+            # save image in a png file in destination folder
+            self.atlas.to_image(result).save(fp=self.output_file.get_full_path())
+            return
+
+        # huge image. split it into bands of rows and have a pool of processes render them into shared memory
+        indices = self.atlas.glyph_indices(weights, self.random)
+        h, w = indices.shape
+        shape = (h * H, w * W, self.atlas.channels)
+        memory = SharedMemory(create=True, size=shape[0] * shape[1] * shape[2])
+        try:
+            pixels = ndarray(shape, dtype=uint8, buffer=memory.buf)
+            result = None
+            try:
+                rows = -(-h // (processes * 4))  # a few bands per process so they finish at about the same time
+                bands = [(start, indices[start:start + rows]) for start in range(0, h, rows)]
+                with self.process_context().Pool(processes, initializer=init_band_worker,
+                                                 initargs=(self.char_images, self.atlas.mode, memory.name,
+                                                           shape)) as pool:
+                    done = 0
+                    for band_rows in pool.imap_unordered(render_band, bands):
+                        done += band_rows
+                        self.preview.progress_amount(80 * done / h)
+
+                self.preview.progress_update("saving image")
+                # the image uses the shared memory as it is, without copying it
+                result = self.atlas.to_image(pixels)
+                self.preview.put_image(image=result)
+                self.preview.progress_amount(90)
+                result.save(fp=self.output_file.get_full_path())
+            finally:
+                # the shared memory can only be closed once nothing uses it, even if saving failed
+                del pixels, result
+        finally:
+            memory.close()
+            memory.unlink()
 
     def convert(self):
         # prepare character images
         self.generate_character_images()
 
+        summary = None
         if self.input_file.extension == File.Types.MP4:
-            self.convert_mp4()
+            summary = self.convert_mp4()
         elif self.input_file.extension == File.Types.GIF:
             self.convert_gif()
         elif self.input_file.extension == File.Types.PNG:  # have to convert an image. convert it
             self.convert_image()
 
-        self.preview.progress_update("ascheatfied.")
+        self.preview.progress_update("ascheatfied." if summary is None else "ascheatfied. " + summary)
         self.preview.progress_amount(100)
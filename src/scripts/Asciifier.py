@@ -1,10 +1,17 @@
-import random
-from PIL import Image, ImageChops
+import cv2
+from PIL import Image, ImageChops, ImageSequence
+from numpy import asarray, empty
+from numpy.random import default_rng
 
 from src.File import File
 from src.Script import Script, OptionList
+from src.TextAnimation import TextAnimationWriter
+from src.WeightTable import WeightTable
 
 
+rows_per_block = 64  # rows of text built and written to the output file at a time
+preview_rows = 100  # rows of text shown in the preview
+
 Resolution = OptionList({
     "small (50)": 50,
     "medium (150)": 150,
@@ -14,40 +21,22 @@ Resolution = OptionList({
 
 # given an image turn it into a string
 class Asciifier(Script):
-    def __init__(self, input_path, output_path, resolution, static, white_on_black):
+    def __init__(self, input_path, output_path, resolution, static, white_on_black, seed=None):
         super().__init__(input_path, output_path)
 
         self._script_name = "Asciify"
-        self._input_types = [File.Types.PNG]
+        self._input_types = [File.Types.PNG, File.Types.GIF, File.Types.MP4]
         self._output_type = File.Types.TXT
 
         self.static = static
         self.white_on_black = white_on_black
         self.resolution = Resolution.get_option_value(resolution)
 
-        self.weights = []
+        self.weights = None  # WeightTable of the characters to use
+        self.random = default_rng(seed)  # the same seed always picks the same characters
 
         self.start()
 
-    # build wright arrays from res/asciify/weights.txt
-    def read_weights(self):
-        # there are 256 possible values (0-255). prepare a spot on the list for each
-        for i in range(256):
-            self.weights.append("")
-
-        with open('res/asciify/weights.txt', 'r') as f:
-            lines = f.readlines()  # one line per weight, each line lists characters with that weight
-            for line in lines:
-                n, p = (int(line.split(": ")[0]), line.split(": ")[1])
-                self.weights[n] = list(map(int, p.split(" ")))
-
-    # pick a single character for each weight to keep palette consistent.
-    # if this method is not called pixels with the same brightness may be different characters
-    def limit_palette(self):
-        for w in range(len(self.weights)):
-            if len(self.weights[w]) > 1:
-                self.weights[w] = [random.choice(self.weights[w])]
-
     def resize_image(self, image):
         w, h = image.size
 
@@ -66,52 +55,8 @@ class Asciifier(Script):
         image = image.resize((int(w), int(h)), resample=Image.LANCZOS)
         return image
 
-    def find_lighter(self, intent):
-        d = 0
-        while intent + d <= 255 and len(self.weights[intent + d]) == 0:
-            d += 1
-        if intent + d > 255:
-            return -1
-        elif len(self.weights[intent + d]) != 0:
-            return d
-
-    def find_darker(self, intent):
-        d = 0
-        while intent - d >= 0 and len(self.weights[intent - d]) == 0:
-            d += 1
-        if intent - d < 0:
-            return -1
-        elif len(self.weights[intent - d]) != 0:
-            return d
-
-    # because not all weight values have characters i have to find the closest weight that does
-    def get_true_weight(self, intent):
-        true = 0
-
-        if len(self.weights[intent]) > 0:
-            true = intent
-        else:
-            light = self.find_lighter(intent)
-            dark = self.find_darker(intent)
-
-            if dark == -1:
-                true = intent + light
-            elif light == -1:
-                true = intent - dark
-            else:
-                if light == dark:
-                    true = random.choice([intent + light, intent - dark])
-                elif light < dark:
-                    true = intent + light
-                elif dark < light:
-                    true = intent - dark
-
-        return true
-
-    # convert a single image into a string of chars and return the result
-    def asciify(self, image):
-        unicode = ""
-
+    # resize the image and get the weight of every pixel, as an array
+    def get_weights(self, image):
         # the first version of asciify was meant for viewing in dark mode (white text on black background)
         # by default lighter pixels become darker characters
         # must invert image to ensure values are correct when viewed in black characters on white background
@@ -119,38 +64,96 @@ class Asciifier(Script):
             image = ImageChops.invert(image)
 
         image = self.resize_image(image)
-        image = image.convert('L')  # black and white
-        w, h = image.size
-        for hi in range(h):
-            for wi in range(w):
-                weight = self.get_true_weight(image.getpixel((wi, hi)))
-                unicode += chr(random.choice(self.weights[weight]))
-            unicode += "\n"
-
-        return unicode
+        return asarray(image.convert('L'))  # black and white
+
+    # convert a grid of weights into text, yielding rows_per_block rows of text at a time
+    def asciify(self, weights):
+        h, w = weights.shape
+        # character codes of a block of rows, with a line break at the end of each row
+        codes = empty((rows_per_block, w + 1), dtype='<u4')
+        codes[:, w] = ord("\n")
+
+        for start in range(0, h, rows_per_block):
+            block = weights[start:start + rows_per_block]
+            codes[:len(block), :w] = self.weights.lookup(block, self.random)  # pick a character for every pixel
+            # the codes are utf-32, so the whole block turns into a string at once
+            yield codes[:len(block)].tobytes().decode('utf-32-le')
+
+    # frames of the input gif or mp4 as (pillow image, duration in milliseconds) and the number of frames
+    def read_frames(self):
+        if self.input_file.extension == File.Types.GIF:
+            with Image.open(self.input_file.get_full_path()) as gif:
+                frame_count = gif.n_frames
+                yield frame_count
+                for frame in ImageSequence.Iterator(gif):
+                    yield frame.convert("RGB"), frame.info['duration']
+        else:
+            video = cv2.VideoCapture(self.input_file.get_full_path())
+            duration = 1000 / video.get(cv2.CAP_PROP_FPS)
+            yield int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+            while video.isOpened():
+                ret, cv2_im = video.read()
+                if not ret:
+                    break
+                yield Image.fromarray(cv2.cvtColor(cv2_im, cv2.COLOR_BGR2RGB)), duration
+            video.release()
+
+    # turn a gif or mp4 into a text animation: the first frame in full, then only the characters that changed
+    def convert_animation(self):
+        frames = self.read_frames()
+        frame_count = max(next(frames), 1)
+
+        self.preview.progress_update("asciifying frames...")
+        result = TextAnimationWriter(self.output_file.get_full_path())
+        weights = None
+        codes = None
+        try:
+            for index, (image, duration) in enumerate(frames):
+                new_weights = self.get_weights(image)
+                if codes is None or codes.shape != new_weights.shape:
+                    codes = self.weights.lookup(new_weights, self.random)
+                else:
+                    # a character only changes if its weight did, otherwise every frame would pick new random
+                    # characters and every character would change every frame
+                    changed = new_weights != weights
+                    codes[changed] = self.weights.lookup(new_weights[changed], self.random)
+                weights = new_weights
+                result.write(codes, duration)
+
+                if index % 10 == 0:
+                    self.preview.put_text("\n".join("".join(map(chr, row)) for row in codes[:preview_rows]))
+                    self.preview.progress_amount(10 + 80 * index / frame_count)
+        finally:
+            result.close()
+        self.preview.progress_amount(100)
+        self.preview.progress_update("asciified animation.")
 
     def convert(self):
-        self.preview.put_image(image_path=self.input_file.get_full_path())
-
         self.preview.progress_update("preparing weights...")
         # prepare character list
-        self.read_weights()
+        self.weights = WeightTable.load('res/asciify/weights.txt')
         if self.static:
-            self.limit_palette()
+            self.weights = self.weights.limit_palette(self.random)
         self.preview.progress_amount(10)
 
+        if self.input_file.extension != File.Types.PNG:
+            self.convert_animation()
+            return
+
+        self.preview.put_image(image_path=self.input_file.get_full_path())
         image = Image.open(self.input_file.get_full_path()).convert("RGB")
 
         self.preview.progress_update("asciifying image...")
-        text = self.asciify(image)
-        self.preview.progress_amount(90)
-
-        # put text in preview
-        self.preview.put_text(text)
+        weights = self.get_weights(image)
 
-        self.preview.progress_update("saving...")
-        # save text in a txt file in destination folder
+        # save text in a txt file in destination folder as it is built, so the whole text is never in memory
         with open(self.output_file.get_full_path(), 'w', encoding='utf-8') as f:
-            f.write(text)
+            for i, text in enumerate(self.asciify(weights)):
+                f.write(text)
+                self.preview.progress_amount(10 + 80 * (i + 1) * rows_per_block / len(weights))
+        self.preview.progress_amount(90)
+
+        # put text in preview; it is read back from the file as it is scrolled through
+        self.preview.put_text_file(self.output_file.get_full_path())
         self.preview.progress_amount(100)
         self.preview.progress_update("asciified image.")
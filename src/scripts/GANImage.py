@@ -1,4 +1,3 @@
-import pickle
 import PIL
 import dnnlib
 import dnnlib.tflib as tflib
@@ -7,6 +6,7 @@ from torchvision import transforms
 import numpy as np
 
 from src.File import File
+from src.ModelPool import ModelPool
 from src.Script import Script, OptionList
 
 models_path = "res/gan/models/"
@@ -61,21 +61,21 @@ class GANImage(Script):
         return tensor
 
     def convert(self):
-        # create tensorflow session in preparation for unpickling model
-        self.preview.progress_update("starting tensorflow session...")
-        session = dnnlib.tflib.init_tf()
-        self.preview.progress_amount(10)
-
-        # load model
+        # load model; it is only loaded from the file if no earlier job loaded it
         self.preview.progress_update("loading model...")
-        file = open(models_path + self.dataset + ".pkl", 'rb')
-        G, D, Gs = pickle.load(file, encoding='latin1')
+        model = ModelPool.get(models_path + self.dataset + ".pkl")
+        try:
+            self.generate_image(model)
+        finally:
+            model.release()
+        self.preview.progress_update("done.")
+
+    def generate_image(self, model):
+        Gs = model.Gs
         Gs_kwargs = dnnlib.EasyDict()
         Gs_kwargs.output_transform = dict(func=tflib.convert_images_to_uint8, nchw_to_nhwc=True)
         Gs_kwargs.randomize_noise = False
         rnd = np.random.RandomState()
-        noise_vars = [var for name, var in Gs.components.synthesis.vars.items() if name.startswith('noise')]
-        tflib.set_vars({var: rnd.randn(*var.shape.as_list()) for var in noise_vars})  # [height, width]
         self.preview.progress_amount(20)
 
         # get input
@@ -88,8 +88,16 @@ class GANImage(Script):
         self.preview.progress_amount(30)
 
         self.preview.progress_update("generating image...")
-        # pass input image through model
-        output = Gs.run(input_image, None, **Gs_kwargs)  # [minibatch, height, width, channel]
+        # pass input image through model. the model may be shared with other jobs, so its noise is set in the same
+        # step as running it, and put back afterwards so later jobs get the noise the model was loaded with
+        with model.running():
+            noise_vars = [var for name, var in Gs.components.synthesis.vars.items() if name.startswith('noise')]
+            loaded_noise = dict(zip(noise_vars, tflib.run(noise_vars)))
+            tflib.set_vars({var: rnd.randn(*var.shape.as_list()) for var in noise_vars})  # [height, width]
+            try:
+                output = Gs.run(input_image, None, **Gs_kwargs)  # [minibatch, height, width, channel]
+            finally:
+                tflib.set_vars(loaded_noise)
         # get image from output
         output_image = PIL.Image.fromarray(output[0], 'RGB')
         self.preview.progress_amount(90)
@@ -100,6 +108,3 @@ class GANImage(Script):
         self.preview.progress_update("saving image...")
         output_image.save(self.output_file.get_full_path())
         self.preview.progress_amount(100)
-
-        session.close()
-        self.preview.progress_update("done.")
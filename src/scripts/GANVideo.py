@@ -1,21 +1,22 @@
-import pickle
 import time
-import PIL
-import cv2
 import dnnlib
 import dnnlib.tflib as tflib
+import tensorflow as tf
 from PIL import Image
-from cv2 import VideoWriter, VideoWriter_fourcc
-from numpy import array
 from numpy.random import RandomState
-import shutil
 
 from src.File import File
+from src.LatentTrajectory import LatentTrajectory
+from src.ModelPool import ModelPool
+from src.Pipeline import Pipeline, Stage
 from src.Script import Script, OptionList
+from src.VideoSink import VideoSink
 from src.globals import Globals
 
 models_path = "res/gan/models/"
 fps = 30
+max_batch_size = 64  # most frames generated by one run of the model
+queue_size = 2  # batches of frames waiting to be encoded
 
 Speeds = OptionList({
     "slow": 1,
@@ -50,6 +51,7 @@ TransitionTypes = OptionList({
 
 class Model:
     def __init__(self, path):
+        self.pooled = None  # the loaded model in the ModelPool
         self.generator = None
         self.shape = (0, 0)
         self.path = path
@@ -61,48 +63,83 @@ class Model:
 
         self.random = RandomState(int(time.time()))
 
+    # get the model from the pool; it is only loaded from the file if no earlier job loaded it
     def load(self):
-        with open(self.path, 'rb') as file:
-            generator, discriminator, generator_s = pickle.load(file, encoding='latin1')
+        self.pooled = ModelPool.get(self.path)
+        self.generator = self.pooled.G
+        self.shape = (1, *self.pooled.Gs.input_shape[1:])
 
-        self.generator = generator
-        self.shape = (1, *generator_s.input_shape[1:])
+    # let the pool unload the model when it needs the memory
+    def release(self):
+        self.pooled.release()
 
     def get_input_shape(self):
         return self.shape
 
+    # (width, height) of the frames, from the shape of the generator's output ([minibatch, channel, height, width])
     def get_output_size(self):
-        # generate one image and get its size
-        output = self.generate_frame(self.get_random_input())
-        return output.size
+        _, _, height, width = self.generator.output_shape
+        return width, height
 
     def get_random_input(self):
         return self.random.randn(*self.get_input_shape())
 
-    def generate_frame(self, input_image):
-        # pass input image through model
-        output = self.generator.run(input_image, None, **self.args)
-        # get image from output
-        output_image = PIL.Image.fromarray(output[0], 'RGB')
-        return output_image
+    # generate a frame for every input in one run of the model. returns an array of shape (inputs, height, width, 3)
+    def generate_frames(self, inputs):
+        with self.pooled.running():
+            return self.generator.run(inputs, None, minibatch_size=len(inputs), **self.args)
+
+
+# how many frames to generate per run of the model. running the model has a cost of its own, so bigger batches make
+# frames faster, up to a point, but take more memory. unless a size is given, it starts at 1 and doubles while that
+# makes frames noticeably faster, and halves whenever a batch runs out of memory
+class BatchSize:
+    def __init__(self, size=None, maximum=max_batch_size):
+        self.size = size or 1
+        self.maximum = maximum
+        self.growing = size is None
+        self.best = 0.0  # best frames per second so far
+        self.batches = 0
+
+    # called after a batch of frames was generated in seconds
+    def update(self, frames, seconds):
+        self.batches += 1
+        if not self.growing or self.batches == 1:  # the first run also builds the graph, it is always slow
+            return
+        speed = frames / seconds
+        if speed < self.best * 1.1 or self.size >= self.maximum:
+            self.growing = False  # not worth the memory
+        else:
+            self.size = min(self.size * 2, self.maximum)
+        self.best = max(self.best, speed)
+
+    # called when a batch ran out of memory
+    def shrink(self):
+        if self.size == 1:
+            raise MemoryError("not enough memory to generate a single frame")
+        self.size //= 2
+        self.growing = False
 
 
 class GANVideo(Script):
 
-    def __init__(self, dataset, input_path, output_path, speed, duration, transition_type):
+    def __init__(self, dataset, input_path, output_path, speed, duration, transition_type, batch_size=None,
+                 slerp=False):
         super().__init__(output_path=output_path)
 
         self.dataset = Datasets.get_option_value(dataset)
         self.speed = Speeds.get_option_value(speed)
         self.transition_type = TransitionTypes.get_option_value(transition_type)
         self.duration = duration
+        self.batch_size = batch_size  # frames generated per run of the model; None to pick automatically
+        self.slerp = slerp  # "sequences" move along the sphere between latents instead of in a straight line
 
         self._script_name = "GAN"
         self._input_types = File.Types.MP4
         self._output_type = File.Types.MP4
 
         self.model = None
-        self.inputs = []
+        self.trajectory = None  # LatentTrajectory the inputs of the frames come from
 
         # start thread
         self.start()
@@ -124,101 +161,77 @@ class GANVideo(Script):
             Globals.gui.update_status("duration must be under 5 minutes", err=True)
             raise ValueError
 
-    def copy_last_input(self):
-        return self.inputs[len(self.inputs) - 1].copy()
-
-    def generate_input(self):
-        # pick number of frames in this batch
-        frames = int(fps / self.speed) * 10
-
-        # amount to increase or decrease by is determined by speed
-        delta = self.speed / 450
-
-        # if the input is empty, generate an initial frame
-        if not self.inputs:
-            self.inputs.append(self.model.get_random_input())
-
-        if self.transition_type == TransitionTypes.get_option_value("random"):
-            for i in range(frames):
-                new_input = self.copy_last_input()
-                # loop over all "pixels" and either increase by delta, decrease by delta, or do nothing
-                for j, pixel in enumerate(new_input):
-                    choice = self.model.random.randint(0, 3)
-                    if choice == 1:
-                        new_input[j] = pixel + delta
-                    elif choice == 2:
-                        new_input[j] = pixel - delta
-                self.inputs.append(new_input)
-
-        elif self.transition_type == TransitionTypes.get_option_value("sequences"):
-            original = self.inputs[len(self.inputs) - 1]
-            goal = self.model.get_random_input()  # generate random input
-            # transition smoothly from original to new
-            for i in range(frames):
-                new_input = self.copy_last_input()
-                # increase each pixel by the initial difference divided by the number of frames
-                for j, pixel in enumerate(new_input[0]):
-                    new_input[0][j] += (goal[0][j] - original[0][j]) / frames
-                self.inputs.append(new_input)
-
-        elif self.transition_type == TransitionTypes.get_option_value("constant"):
-            for i in range(frames):
-                new_input = self.copy_last_input()
-                # loop over all "pixels" and increase by delta
-                for j, pixel in enumerate(new_input):
-                    new_input[j] = pixel + delta
-                self.inputs.append(new_input)
+        if self.transition_type not in (TransitionTypes.get_option_value("random"),
+                                        TransitionTypes.get_option_value("sequences"),
+                                        TransitionTypes.get_option_value("constant")):
+            Globals.gui.update_status("this transition type is not available yet", err=True)
+            raise ValueError
 
     def convert(self):
-        # create tensorflow session in preparation for unpickling model
-        self.preview.progress_update("starting tensorflow session...")
-        try:
-            session = dnnlib.tflib.init_tf()
-        except AssertionError:
-            # this happens every time the gan video is rerun without restarting the app
-            print("caught you")
-            pass
-        self.preview.progress_amount(5)
-
         # load model
         self.preview.progress_update("loading model...")
         self.model = Model(models_path + self.dataset + ".pkl")
         self.model.load()
         self.preview.progress_amount(10)
+        try:
+            summary = self.generate_video()
+        finally:
+            self.model.release()
+        self.preview.progress_update("done. " + summary)
 
-        # prepare output
-        result = VideoWriter(Globals.working_folder_path + "\\video.mp4",
-                             VideoWriter_fourcc('m', 'p', '4', 'v'), fps, self.model.get_output_size())
-
-        # keep generating until we reach desired length
-        frames = 0
-        frames_goal = self.duration * 60 * fps   # duration is given in minutes
-        while frames < frames_goal:
-            if len(self.inputs) <= 2:
-                # generate batch of input
-                self.preview.progress_update("generating input...")
-                self.generate_input()
-                self.preview.progress_update("generating frames...")
-
-            frame = self.model.generate_frame(self.inputs.pop(0))  # remove first input
-
-            # write frame to output
-            frame_array = cv2.cvtColor(array(frame), cv2.COLOR_RGB2BGR)
-            result.write(frame_array)  # write method takes numpy array as parameter
-
-            # update preview once every 10 frames
-            if frames % 10 == 0 or frames == frames_goal:
-                self.preview.progress_amount(10 + 85 * frames / frames_goal)
-                self.preview.put_image(frame)
+    # returns how fast the video was made
+    def generate_video(self):
+        # prepare output; frames are piped straight into the output file
+        result = VideoSink(self.output_file.get_full_path(), self.model.get_output_size(), fps)
 
-            frames += 1
+        # inputs are made as they are needed
+        self.trajectory = LatentTrajectory(self.model.get_random_input(), self.transition_type, self.speed, fps,
+                                           self.model.random, slerp=self.slerp)
 
-        result.release()
+        # frames are generated on one thread and written on another, so the model never waits for the video file
+        batch = BatchSize(self.batch_size)
+        frames_goal = int(self.duration * 60 * fps)  # duration is given in minutes
+        written = [0]
 
-        # copy temporary file to destination folder
-        self.preview.progress_update("saving image...")
-        shutil.copyfile(Globals.working_folder_path + "\\video.mp4", self.output_file.get_full_path())
+        # keep generating until we reach desired length
+        def generate_batches():
+            frames = 0
+            while frames < frames_goal:
+                size = min(batch.size, frames_goal - frames)
+                batch_start = time.perf_counter()
+                try:
+                    output = self.model.generate_frames(self.trajectory.peek(size))
+                except (MemoryError, tf.errors.ResourceExhaustedError):
+                    batch.shrink()  # and try the same inputs again
+                    continue
+                batch.update(size, time.perf_counter() - batch_start)
+                self.trajectory.advance(size)  # remove used inputs
+                frames += size
+                yield output
+
+        def encode(output):
+            for frame in output:
+                # write frame to output
+                result.write(frame)
+
+                # update preview once every 10 frames
+                if written[0] % 10 == 0 or written[0] == frames_goal:
+                    self.preview.progress_amount(10 + 85 * written[0] / frames_goal)
+                    self.preview.put_image(Image.fromarray(frame, 'RGB'))
+
+                written[0] += 1
+
+        self.preview.progress_update("generating frames...")
+        pipeline = Pipeline(generate_batches(), [Stage("generate", lambda output: output), Stage("encode", encode)],
+                            queue_size=queue_size)
+        start = time.perf_counter()
+        try:
+            pipeline.run()
+        finally:
+            self.preview.progress_update("saving video...")
+            result.close()
         self.preview.progress_amount(100)
 
-        session.close()
-        self.preview.progress_update("done.")
+        # shown with the final status
+        return str(round(written[0] / (time.perf_counter() - start), 1)) + " frames/s (batch size " + \
+            str(batch.size) + "; " + pipeline.report("batches") + ")"
@@ -1,21 +1,57 @@
+from collections import deque
 from math import sqrt
+from multiprocessing import cpu_count
+from time import perf_counter
 from PIL import Image
-from pydub import AudioSegment
-import tomita.legacy.pysynth as synth
+import numpy as np
 
+from src.AudioSink import AudioSink
 from src.File import File
+from src.MidiWriter import MidiWriter
 from src.Script import Script
-from src.globals import Globals
+from src.Synthesizer import Synthesizer, Voice
+
+chunk_seconds = 10  # the track is made and encoded this many seconds at a time
+queue_size = 4  # chunks rendered ahead of the encoder
+rows_per_band = 16  # rows of pixels turned into notes at a time
+# images with at least this many pixels have their channels rendered by a pool of processes. copying notes out of the
+# memory-mapped synthesizer is quick, so for smaller images starting the workers and sending them the chunks costs more
+# than it saves
+pool_pixels = 500 * 500
+# the draft, a quick low quality version of the start of the track shown while the whole track is made
+draft_seconds = 15
+draft_rate = 11025  # sample rate of the draft; must divide Synthesizer.SAMPLE_RATE
+draft_budget = 1.0  # seconds making the draft may take; if the notes take longer to make, the draft is shorter
+
+
+# the synthesizer of a worker process, set once by init_channel_worker
+channel_worker = None
+
+
+def init_channel_worker():
+    global channel_worker
+    channel_worker = Synthesizer.load()
+
+
+# render part of one channel; job holds the arguments of Synthesizer.render_part
+def render_chunk(job):
+    return channel_worker.render_part(*job)
 
 
 class ImageToMP3(Script):
 
-    def __init__(self, input_path, output_path):
+    def __init__(self, input_path, output_path, processes=None, long_form=False, score=False):
         super().__init__(input_path, output_path)
 
         self._script_name = "ImageToMP3"
         self._input_types = [File.Types.PNG]
-        self._output_type = File.Types.MP3
+        self._output_type = File.Types.MID if score else File.Types.MP3
+
+        # processes rendering the color channels (at most 3); None to use one for small images and every core for big ones
+        self.processes = processes
+        # use every pixel of the image instead of making it smaller first; the track can be hours long
+        self.long_form = long_form
+        self.score = score  # only write the notes, as a midi file with a track per color channel
 
         self.start()
 
@@ -29,94 +65,181 @@ class ImageToMP3(Script):
             new_x = max(int(x / div), 1)  # dimensions have to be at least 1
             new_y = max(int(y / div), 1)
             image = image.resize((new_x, new_y), resample=Image.LANCZOS)  # a slow but good resizing algorithm
-        image.save(Globals.working_folder_path + "/smallified.png")
         return image
 
-    # converts the image to a tuple of note codes
+    # converts an image, or an array of its rgb pixels, to the keys and lengths of the notes of each color channel.
+    # first is false for the parts of an image after the first one
     @staticmethod
-    def convert_to_notes(image):
-        note_sequence = []
-        for i in range(3):  # one for each color channel (r, g, b)
-            note_sequence.append([('r', 4)])  # each channel begins with a rest
-        notes = [
-            "a0", "a#0", "b0", "c1", "c#1", "d1", "d#1", "e1", "f1", "f#1", "g1", "g#1", "a1", "a#1", "b1", "c2", "c#2",
-            "d2", "d#2", "e2", "f2", "f#2", "g2", "g#2", "a2", "a#2", "b2", "c3", "c#3", "d3", "d#3", "e3", "f3", "f#3",
-            "g3", "g#3", "a3", "a#3", "b3", "c4", "c#4", "d4", "d#4", "e4", "f4", "f#4", "g4", "g#4", "a4", "a#4", "b4",
-            "c5", "c#5", "d5", "d#5", "e5", "f5", "f#5", "g5", "g#5", "a5", "a#5", "b5", "c6", "c#6", "d6", "d#6", "e6",
-            "f6", "f#6", "g6", "g#6", "a6", "a#6", "b6", "c7", "c#7", "d7", "d#7", "e7", "f7", "f#7", "g7", "g#7", "a7",
-            "a#7", "b7", "c8"]
-        # ^ for easy converting from rgb value to note
-
-        pixel_map = image.load()  # image pixel data
-        x, y = image.size
+    def convert_to_notes(image, first=True):
+        pixels = np.asarray(image, dtype=np.int64)
+        rows, width, _ = pixels.shape
 
-        for i in range(y):
-            for j in range(x):
-                r, g, b = pixel_map[j, i]  # get r g b values of current pixel
-                red_pitch = r % 88
-                red_length = (r / 88 + 1) * 2  # number magic
-                note_sequence[0].append((str(notes[red_pitch]), int(red_length)))  # red note
-                green_pitch = g % 88
-                green_length = (g / 88 + 1) * 2
-                note_sequence[1].append((str(notes[green_pitch]), int(green_length)))  # green note
-                blue_pitch = b % 88
-                blue_length = (b / 88 + 1) * 2
-                note_sequence[2].append((str(notes[blue_pitch]), int(blue_length)))  # blue note
-
-            # this doesn't have much practical effect in this new conversion
-            for k in range(3):  # one for each color channel (r, g, b)
-                note_sequence[k].append(('r', 4))  # a rest at the end of each line
+        # every pixel is a note, and every row ends with a rest
+        keys = np.full((rows, width + 1, 3), Synthesizer.REST, dtype=np.int64)
+        lengths = np.full((rows, width + 1, 3), 4, dtype=np.int64)
+        keys[:, :-1] = pixels % 88
+        lengths[:, :-1] = pixels // 44 + 2  # number magic; int((value / 88 + 1) * 2)
 
+        notes_sequence = []
         for i in range(3):  # one for each color channel (r, g, b)
-            note_sequence[i] = tuple(note_sequence[i])  # turn the list into a tuple (that's what synth's function uses)
-
-        return note_sequence
-
+            channel_keys = keys[:, :, i].ravel()
+            channel_lengths = lengths[:, :, i].ravel()
+            if first:  # each channel begins with a rest
+                channel_keys = np.concatenate(([Synthesizer.REST], channel_keys))
+                channel_lengths = np.concatenate(([4], channel_lengths))
+            notes_sequence.append((channel_keys, channel_lengths))
+        return notes_sequence
+
+    # yields (pixels, keys and lengths of every channel) for every rows_per_band rows of the image, so the notes of
+    # the whole image never exist at the same time
+    @staticmethod
+    def read_bands(image):
+        width, height = image.size
+        for top in range(0, height, rows_per_band):
+            band = image.crop((0, top, width, min(top + rows_per_band, height)))
+            yield band.width * band.height, ImageToMP3.convert_to_notes(band, first=(top == 0))
+
+    # renders the channels a chunk at a time and mixes them, yields (pixels done, mixed samples).
+    # bands are consecutive parts of the song, as yielded by read_bands; a chunk is rendered as soon as every channel
+    # has notes past its end, and at most queue_size chunks are rendered ahead of the one being yielded.
+    # processes is the number of processes rendering the channels; None to use every core (at most 3)
     @staticmethod
-    def notes_to_wav(notes_sequence):
-        wav_path = Globals.working_folder_path + "/temp.wav"
-        synth.make_wav(notes_sequence[0], fn=wav_path, silent=True)  # create wav
-        red = AudioSegment.from_file(wav_path)  # open wav with AudioSegment
-        yield 1  # finished first channel
-        synth.make_wav(notes_sequence[1], fn=wav_path, silent=True)
-        green = AudioSegment.from_file(wav_path)
-        yield 2  # second channel
-        synth.make_wav(notes_sequence[2], fn=wav_path, silent=True)
-        blue = AudioSegment.from_file(wav_path)
-        yield 3  # third
-
-        combined = red.overlay(green)
-        combined = combined.overlay(blue)
-
-        combined.export(wav_path, format='wav')
-
-    # converts the wav to mp3
+    def synthesize(bands, processes=1):
+        synthesizer = Synthesizer.load()  # make sure the notes are saved before the workers try to load them
+        processes = min(processes or cpu_count(), 3)
+        if processes > 1:
+            # the channels are independent, render them at the same time
+            pool = ImageToMP3.process_context().Pool(processes, initializer=init_channel_worker)
+        else:
+            pool = None
+            init_channel_worker()
+
+        chunk = chunk_seconds * Synthesizer.SAMPLE_RATE
+        voices = None
+        pixels = 0
+        pending = deque()  # (pixels, channels) of the chunks being rendered, oldest first
+
+        # start rendering the next samples of every channel up to end
+        def render(end):
+            jobs = [voice.take(end) for voice in voices]
+            pending.append((pixels, [pool.apply_async(render_chunk, (job,)) for job in jobs] if pool is not None
+                            else [render_chunk(job) for job in jobs]))
+
+        # the mixed samples of a chunk, once all its channels are rendered
+        def finish(done, channels):
+            if pool is not None:
+                channels = [channel.get() for channel in channels]
+            return done, ImageToMP3.mix(channels)
+
+        try:
+            for band_pixels, notes_sequence in bands:
+                if voices is None:
+                    voices = [Voice(synthesizer) for _ in notes_sequence]
+                for voice, (keys, lengths) in zip(voices, notes_sequence):
+                    voice.add(keys, lengths)
+                pixels += band_pixels
+
+                ready = min(voice.end() for voice in voices)
+                while voices[0].rendered + chunk <= ready:
+                    render(voices[0].rendered + chunk)
+                    if len(pending) > queue_size:
+                        yield finish(*pending.popleft())
+
+            # the rest of the song, as long as the longest channel
+            end = max(voice.end() for voice in voices)
+            while voices[0].rendered < end:
+                render(min(voices[0].rendered + chunk, end))
+                if len(pending) > queue_size:
+                    yield finish(*pending.popleft())
+            while pending:
+                yield finish(*pending.popleft())
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    # the first draft_seconds of the track at draft_rate, made from the first rows of the image only
     @staticmethod
-    def wav_to_mp3(output_path):
-        AudioSegment.from_wav(Globals.working_folder_path + "\\temp.wav").export(output_path, format="mp3")
+    def draft(image):
+        deadline = perf_counter() + draft_budget
+        synthesizer = Synthesizer.load()
+        voices = None
+        for _, notes_sequence in ImageToMP3.read_bands(image):
+            if voices is None:
+                voices = [Voice(synthesizer) for _ in notes_sequence]
+            for voice, (keys, lengths) in zip(voices, notes_sequence):
+                voice.add(keys, lengths)
+            if min(voice.end() for voice in voices) >= draft_seconds * Synthesizer.SAMPLE_RATE or \
+                    perf_counter() > deadline:
+                end = min(voice.end() for voice in voices)  # every channel has notes up to here
+                break
+        else:
+            end = max(voice.end() for voice in voices)  # the whole track is shorter than the draft
+        end = min(end, draft_seconds * Synthesizer.SAMPLE_RATE)
+
+        # the notes are rendered at the full sample rate, but only every few samples are kept. that would alias
+        # frequencies above half of draft_rate, but even the harmonics of the notes stay below that
+        mixed = ImageToMP3.mix([synthesizer.render_part(*voice.take(end)) for voice in voices])
+        return mixed[::Synthesizer.SAMPLE_RATE // draft_rate]
+
+    # writes the notes of every channel to a midi file, a track per channel. the image is turned into notes once for
+    # every track, since a midi file holds the tracks one after another
+    @staticmethod
+    def write_score(image, output_path):
+        result = MidiWriter(output_path, 3)
+        try:
+            for i, name in enumerate(("red", "green", "blue")):
+                result.start_track(name)
+                for _, notes_sequence in ImageToMP3.read_bands(image):
+                    result.write_notes(*notes_sequence[i])
+                result.end_track()
+        finally:
+            result.close()
+
+    # adds the channels of a chunk together, clipping the sum to 16 bits like overlaying them in pydub did
+    @staticmethod
+    def mix(channels):
+        mixed = np.zeros(len(channels[0]), dtype=np.int32)
+        for channel in channels:
+            mixed += channel
+        return np.clip(mixed, -32768, 32767).astype(np.int16)
 
     def convert(self):
         image = Image.open(self.input_file.get_full_path()).convert("RGB")
 
         # make image smaller
         self.preview.progress_update("preparing image")
-        image = self.smallify(image)
+        if not self.long_form:
+            image = self.smallify(image)
+        pixels = image.width * image.height
         self.preview.progress_amount(10)
 
-        # convert image to notes
-        self.preview.progress_update("converting to notes")
-        notes_sequence = self.convert_to_notes(image)
-        self.preview.progress_amount(25)
+        if self.score:
+            self.preview.progress_update("writing score")
+            self.write_score(image, self.output_file.get_full_path())
+            self.preview.progress_amount(100)
+            self.preview.progress_update("converted image to a score")
+            return
 
-        # build wav file (that's the only format synth knows to create)
-        self.preview.progress_update("building sounds")
-        for i in self.notes_to_wav(notes_sequence):  # creates wav file in working folder, yields progress
-            self.preview.progress_amount(25 + i * 20)
+        # a draft of the start of the track to listen to while the rest is made
+        self.preview.progress_update("making draft")
+        self.preview.put_audio(self.draft(image), draft_rate)
 
-        # convert wav to mp3
-        self.preview.progress_update("exporting " + self.input_file.file_name + ".mp3")
-        self.wav_to_mp3(self.output_file.get_full_path())
+        # convert the image to notes and the notes to sounds a few rows at a time, encoding the sounds as they are made
+        self.preview.progress_update("building sounds")
+        processes = self.processes
+        if processes is None and pixels < pool_pixels:
+            processes = 1
+        result = AudioSink(self.output_file.get_full_path(), Synthesizer.SAMPLE_RATE)
+        start = perf_counter()
+        try:
+            for done, samples in self.synthesize(self.read_bands(image), processes):
+                result.write(samples)
+                self.preview.progress_amount(10 + done / pixels * 90)
+        finally:
+            self.preview.progress_update("exporting " + self.input_file.file_name + ".mp3")
+            result.close()
+        speed = pixels / (perf_counter() - start)
         self.preview.progress_amount(100)
 
-        self.preview.progress_update("converted image to music")
+        self.preview.progress_update("converted image to music (" + str(round(speed, 1)) + " pixels/s)")
 